@@ -0,0 +1,346 @@
+#!/usr/bin/env python3.5
+"""Measures the per-call latency and throughput of the driver methods against the fake devices
+in artiqDrivers.fakeDevices, so that performance regressions can be caught without hardware.
+
+Run with: python3 -m artiqDrivers.benchmark [--latency SECONDS] [--repeats N] [device ...]
+
+With --check, the median latency of every method is compared with the baseline stored next
+to this file (or another one saved earlier by --save-baseline, given with --baseline), and
+the exit code is 1 if any has got slower by more than the tolerance. Save a new baseline on the machine the
+check runs on, as the latencies depend on it.
+
+With --imports, instead measures how long each controller in setup.py's console_scripts
+takes to import its frontend module in a fresh interpreter, which bounds how quickly a
+controller can be restarted."""
+
+import argparse
+import ast
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from artiqDrivers import fakeDevices
+
+
+def _call(loop, fn, *args):
+    """Call a driver method, running it to completion if it is a coroutine"""
+    result = fn(*args)
+    if asyncio.iscoroutine(result):
+        result = loop.run_until_complete(result)
+    return result
+
+
+def bench(loop, fn, *args, repeats=100):
+    """Call fn(*args) repeats times. Returns a dictionary of latency statistics in seconds and
+    the throughput in calls per second"""
+    latencies = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        _call(loop, fn, *args)
+        latencies.append(time.perf_counter() - t0)
+    return {'mean': statistics.mean(latencies),
+            'median': statistics.median(latencies),
+            'max': max(latencies),
+            'rate': len(latencies) / sum(latencies)}
+
+
+def coherentDds(latency):
+    from artiqDrivers.devices.coherentDds.driver import CoherentDds
+    fake = fakeDevices.FakeCoherentDds(latency)
+    dev = CoherentDds(fake.addr, 1e9)
+    table = [(ch, p, 100e6 + p, 0.0, 1.0) for ch in range(4) for p in range(8)]
+    freqs = iter(range(10**9))
+
+    def setProfilesUncached():
+        dev.invalidateProfileCache()
+        return dev.setProfiles(table)
+
+    cases = [
+        ("identity", dev.identity),
+        ("setProfile (cached)", lambda: dev.setProfile(0, 0, 100e6)),
+        ("setProfile", lambda: dev.setProfile(0, 0, 100e6 + next(freqs))),
+        ("setProfiles 32 profiles", setProfilesUncached),
+        ("setPulseShape 2048 points", lambda: dev.setPulseShape(0, [0.5]*2048)),
+        ("reset", dev.reset),
+    ]
+    return cases, [dev.transport, fake]
+
+
+def arduinoDds(latency):
+    from artiqDrivers.devices.arduinoDds.driver import ArduinoDds
+    fake = fakeDevices.FakeArduinoDds(latency, acknowledged=True)
+    dev = ArduinoDds(fake.addr, 1e9, acknowledged=True)
+    freqs = iter(range(10**9))
+    cases = [
+        ("identity", dev.identity),
+        ("setProfile (cached)", lambda: dev.setProfile(0, 100e6)),
+        ("setProfile", lambda: dev.setProfile(0, 100e6 + next(freqs))),
+        ("reset", dev.reset),
+    ]
+    return cases, [dev.transport, fake]
+
+
+def dosDac(latency):
+    from artiqDrivers.devices.dosDac.driver import DosDac
+    fake = fakeDevices.FakeDosDac(latency)
+    dev = DosDac(fake.addr)
+    # Scan steps 1ms apart rather than the real 50ms, so the time is mostly the driver's
+    dev.ramps.interval = 1e-3
+    values = iter(range(10**9))
+    scanTargets = iter([500, 0]*10**6)
+    cases = [
+        ("getDac", lambda: dev.getDac('866freq')),
+        ("setDac Btrim", lambda: dev.setDac('Btrim', next(values) % 1000)),
+        ("setDac slow scan 10 steps", lambda: dev.setDac('866freq', next(scanTargets))),
+    ]
+    return cases, [dev.dev.transport, fake]
+
+
+def trapDac(latency):
+    from artiqDrivers.devices.trapDac.driver import TrapDac
+    fakeDC = fakeDevices.FakeOldlabDC(latency)
+    fakeRF = fakeDevices.FakeOldlabRFAttenuator(latency)
+    dev = TrapDac(fakeDC.addr, fakeRF.addr)
+    traps = iter(['loading', 'tight']*10**6)
+    transports = iter([('loading', 'tight'), ('tight', 'loading')]*10**6)
+    cases = [
+        ("setTrap (cached)", lambda: dev.setTrap('tight')),
+        ("setTrap", lambda: dev.setTrap(next(traps))),
+        ("transportTrap 20 steps", lambda: dev.transportTrap(*next(transports), 20)),
+        ("transportTrap 20 steps (uncached)",
+            lambda: dev.transportTrap(*next(transports), 20, cache=False)),
+    ]
+    return cases, [dev.dcIf.transport, dev.rfIf.transport, fakeDC, fakeRF]
+
+
+def ql355(latency):
+    from artiqDrivers.devices.tti_ql355.driver import QL355
+    fake = fakeDevices.FakeQL355(latency)
+    dev = QL355(fake.addr)
+    cases = [
+        ("identity", dev.identity),
+        ("set_voltage_limit", lambda: dev.set_voltage_limit(5.0, 0)),
+        ("get_voltage_limit", lambda: dev.get_voltage_limit(0)),
+        ("get_voltage", lambda: dev.get_voltage(0)),
+        ("get_current", lambda: dev.get_current(1)),
+        ("get_status", dev.get_status),
+    ]
+    return cases, [dev.transport, fake]
+
+
+class TemporaryWorkingDirectory:
+    """Changes to a new temporary directory, until closed, when the directory is removed"""
+    def __init__(self):
+        self.oldCwd = os.getcwd()
+        self.dir = tempfile.TemporaryDirectory()
+        os.chdir(self.dir.name)
+
+    def close(self):
+        os.chdir(self.oldCwd)
+        self.dir.cleanup()
+
+
+def piezo(latency):
+    from artiqDrivers.devices.thorlabs_mdt69xb.driver import PiezoController
+    fake = fakeDevices.FakeMDT69xB(latency)
+    # The driver keeps its setpoint files in the working directory
+    workDir = TemporaryWorkingDirectory()
+    try:
+        dev = PiezoController(fake.addr)
+    except Exception:
+        workDir.close()
+        raise
+
+    async def burst():
+        # A feedback loop updating faster than the link: only the latest value is sent
+        for i in range(100):
+            await dev.set_channel('x', 10.0 + i % 10, wait=False)
+        await dev.flush()
+
+    cases = [
+        ("get_voltage_limit", dev.get_voltage_limit),
+        ("set_channel", lambda: dev.set_channel('x', 10.0)),
+        ("set_channel burst of 100", burst),
+        ("set_channels x, y, z", lambda: dev.set_channels({'x': 10.0, 'y': 20.0, 'z': 30.0})),
+        ("get_channel_output", lambda: dev.get_channel_output('x')),
+        ("get_serial", dev.get_serial),
+    ]
+    # Closing the driver writes its setpoints, so only then remove the directory
+    return cases, [dev, fake, workDir]
+
+
+def rohdeSynth(latency):
+    from artiqDrivers.devices.rohdeSynth.driver import RohdeSynth
+    fake = fakeDevices.FakeRohdeSynth(latency)
+    dev = RohdeSynth(fake.addr, port=fake.port)
+    cases = [
+        ("setFrequency", lambda: dev.setFrequency(100e6)),
+        ("frequency", dev.frequency),
+        ("status", dev.status),
+        ("setFrequencyList 100 points", lambda: dev.setFrequencyList([1e6*(i+1) for i in range(100)])),
+        ("setFrequencySweep", lambda: dev.setFrequencySweep(100e6, 200e6, 101)),
+        ("setPowerSweep", lambda: dev.setPowerSweep(-30, -10, 21)),
+        ("resetSweep", dev.resetSweep),
+    ]
+    return cases, [dev, fake]
+
+
+defaultBaseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarkBaseline.json")
+
+
+def save_baseline(fname, latency, medians):
+    with open(fname, "w") as f:
+        medians = {name: round(median, 7) for name, median in medians.items()}
+        json.dump({"latency": latency, "medians": medians}, f, indent=4, sort_keys=True)
+        f.write("\n")
+
+
+def load_baseline(fname):
+    with open(fname) as f:
+        return json.load(f)
+
+
+def compare_baseline(baseline, medians, tolerance, slack):
+    """Compares median latencies in seconds, keyed by case name, with a baseline. A case has
+    regressed if it is slower than tolerance*baseline + slack. Returns the names of the
+    regressed cases"""
+    regressions = []
+    for name, median in medians.items():
+        if name not in baseline["medians"]:
+            print("{}: not in baseline".format(name))
+            continue
+        limit = tolerance*baseline["medians"][name] + slack
+        if median > limit:
+            print("{}: REGRESSION, median {:.3f}ms > {:.3f}ms (baseline {:.3f}ms)".format(
+                name, median*1e3, limit*1e3, baseline["medians"][name]*1e3))
+            regressions.append(name)
+    return regressions
+
+
+suites = {
+    "coherentDds": coherentDds,
+    "arduinoDds": arduinoDds,
+    "dosDac": dosDac,
+    "trapDac": trapDac,
+    "ql355": ql355,
+    "piezo": piezo,
+    "rohdeSynth": rohdeSynth,
+}
+
+
+def console_scripts():
+    """Returns (name, module) for each console_scripts entry point in setup.py"""
+    setupFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "setup.py")
+    with open(setupFile) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(t.id == "scripts" for t in node.targets):
+            entries = ast.literal_eval(node.value)
+            break
+    else:
+        raise ValueError("No 'scripts' list found in setup.py")
+    for entry in entries:
+        name, target = entry.split("=")
+        yield name.strip(), target.split(":")[0].strip()
+
+
+def import_time(module):
+    """Time taken to import a module in a fresh interpreter, in seconds"""
+    code = ("import time; t0 = time.perf_counter(); import {}; "
+            "print(time.perf_counter() - t0)").format(module)
+    result = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout)
+
+
+def bench_imports(repeats):
+    print("{:<40} {:>10} {:>10} {:>10}".format("controller", "mean/ms", "median/ms", "min/ms"))
+    for name, module in console_scripts():
+        try:
+            times = [import_time(module) for _ in range(repeats)]
+        except ImportError as e:
+            print("{}: skipped ({})".format(name, e))
+            continue
+        print("{:<40} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            name, statistics.mean(times)*1e3, statistics.median(times)*1e3, min(times)*1e3))
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="Driver latency benchmarks against fake devices")
+    parser.add_argument("--latency", default=0.0, type=float,
+                        help="response latency of the fake devices in seconds")
+    parser.add_argument("--repeats", default=100, type=int,
+                        help="number of calls to time per method")
+    parser.add_argument("--check", action="store_true",
+                        help="fail if any method is slower than in the baseline")
+    parser.add_argument("--baseline", default=defaultBaseline, metavar="FILE",
+                        help="baseline file for --check (default: the stored one)")
+    parser.add_argument("--save-baseline", default=None, metavar="FILE",
+                        help="save the median latencies as a baseline")
+    parser.add_argument("--tolerance", default=2.0, type=float,
+                        help="slowdown factor over the baseline counted as a regression")
+    parser.add_argument("--slack", default=0.2e-3, type=float,
+                        help="time in seconds allowed on top of the tolerance, so that "
+                             "noise on very fast methods isn't counted as a regression")
+    parser.add_argument("--imports", action="store_true",
+                        help="time the imports of the controllers instead, "
+                             "repeats times each")
+    parser.add_argument("devices", nargs="*",
+                        help="devices to benchmark, from {} (default: all)".format(", ".join(sorted(suites))))
+    return parser
+
+
+def main():
+    parser = get_argparser()
+    args = parser.parse_args()
+    for name in args.devices:
+        if name not in suites:
+            parser.error("unknown device '{}'".format(name))
+    if args.imports:
+        bench_imports(args.repeats)
+        return
+    if args.check:
+        baseline = load_baseline(args.baseline)
+        if baseline["latency"] != args.latency:
+            parser.error("baseline '{}' was taken with --latency {}".format(
+                args.baseline, baseline["latency"]))
+    loop = asyncio.get_event_loop()
+
+    print("{:<40} {:>10} {:>10} {:>10} {:>10}".format(
+        "method", "mean/ms", "median/ms", "max/ms", "calls/s"))
+    medians = {}
+    for name in args.devices or sorted(suites):
+        try:
+            cases, resources = suites[name](args.latency)
+        except ImportError as e:
+            print("{}: skipped ({})".format(name, e))
+            continue
+        try:
+            for case, fn in cases:
+                r = bench(loop, fn, repeats=args.repeats)
+                medians[name + "." + case] = r['median']
+                print("{:<40} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.0f}".format(
+                    name + "." + case, r['mean']*1e3, r['median']*1e3, r['max']*1e3, r['rate']))
+        finally:
+            for resource in resources:
+                resource.close()
+
+    if args.save_baseline is not None:
+        save_baseline(args.save_baseline, args.latency, medians)
+    if args.check:
+        regressions = compare_baseline(baseline, medians, args.tolerance, args.slack)
+        if regressions:
+            print("{} of {} methods regressed".format(len(regressions), len(medians)))
+            sys.exit(1)
+        print("No regressions against '{}'".format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
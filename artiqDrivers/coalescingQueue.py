@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingQueue:
+    """Queue of per-channel setpoints, written by a background task as fast as the device
+    accepts them.
+
+    Only the latest value for each channel is kept: putting a value for a channel that has
+    a value still waiting to be sent replaces it, so a fast stream of updates never backs up
+    behind the link. Channels are written in the order they were first queued; replacing a
+    waiting value doesn't move its channel back.
+
+    If write_many is given, everything queued while the previous write was in progress is
+    written with one call to it, so that the device can be sent several commands at once."""
+    def __init__(self, write, write_many=None):
+        """write : coroutine function write(channel, value) that sets a channel
+        write_many : optional coroutine function write_many({channel: value}) that sets
+            several channels"""
+        self.write = write
+        self.write_many = write_many
+        # Values not yet sent, with the futures waiting on them, keyed by channel in the
+        # order they were queued
+        self._pending = OrderedDict()
+        # [(channel, futures)] of the values being written
+        self._inflight = []
+        self._task = None
+
+    def put(self, channel, value):
+        """Queue a value for a channel and return immediately.
+
+        Returns a future that completes, with the value written, once this value or a later
+        one for the same channel has been written; or with the exception if the write fails."""
+        future = asyncio.Future()
+        # Assigning to an existing key keeps its place in the queue
+        _, futures = self._pending.get(channel, (None, []))
+        futures.append(future)
+        self._pending[channel] = (value, futures)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return future
+
+    async def _run(self):
+        while self._pending:
+            if self.write_many is None:
+                channel, entry = self._pending.popitem(last=False)
+                batch = {channel: entry}
+            else:
+                batch, self._pending = self._pending, OrderedDict()
+            self._inflight = [(channel, futures) for channel, (_, futures) in batch.items()]
+            values = {channel: value for channel, (value, _) in batch.items()}
+            try:
+                if self.write_many is None:
+                    await self.write(channel, values[channel])
+                else:
+                    await self.write_many(values)
+            except Exception as e:
+                logger.exception("Writing {} failed".format(values))
+                for _, futures in self._inflight:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                            # Don't complain about failures no one waited for
+                            future.exception()
+            else:
+                for channel, futures in self._inflight:
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(values[channel])
+            finally:
+                self._inflight = []
+
+    def is_pending(self, channel):
+        """Whether a channel has a value queued or being written"""
+        return channel in self._pending or any(c == channel for c, _ in self._inflight)
+
+    async def flush(self, channel=None):
+        """Wait until the values queued so far for a channel (or for all channels if channel
+        is None) have been written. Raises the exception of a failed write, if any"""
+        entries = [(c, futures) for c, (_, futures) in self._pending.items()]
+        entries += self._inflight
+        futures = [f for c, fs in entries if channel is None or c == channel for f in fs]
+        # Shield, so that a client giving up waiting doesn't cancel the writes
+        for future in futures:
+            await asyncio.shield(future)
@@ -2,6 +2,8 @@ import time
 import serial
 import logging
 
+from artiqDrivers.serialTransport import SerialTransport, transaction
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,22 +23,52 @@ class ArduinoDds:
     lsbAmp = 1.0 / 16383 # 0x3fff is maximum amplitude
     lsbPhase = 360.0 / 65536 # Degrees per LSB.
   
-    def __init__(self, addr, clockFreq):
+    def __init__(self, addr, clockFreq, acknowledged=False, timeout=1.0, bootTimeout=5.0):
         # addr : serial port name
         # clockFreq : clock frequency in Hz
+        # acknowledged : True if the firmware replies with a line to every PLSB command. Otherwise
+        #   we fall back to waiting a fixed time after each command
+        # timeout : serial read timeout in seconds
+        # bootTimeout : maximum time to wait for the Arduino to come out of reset after connecting
         
-        self.ser = serial.Serial(addr, baudrate=115200)
+        self.transport = SerialTransport(serial.Serial(addr, baudrate=115200), timeout=timeout)
+        self.acknowledged = acknowledged
         self.lsbFreq = clockFreq / (2**32);
         self.clockFreq = clockFreq
-        time.sleep(5)
-        logger.info("Connected to ArduinoDDS with ID '{}'".format(self.identity()))
+        
+        # Shadow copy of the (freq, phase, amp) words loaded in each profile, used to skip
+        # writes that would not change anything
+        self.profileCache = {}
+        self.profileCacheHits = 0
+        self.profileCacheMisses = 0
+        
+        logger.info("Connected to ArduinoDDS with ID '{}'".format(self._waitForBoot(bootTimeout)))
+    
+    def _waitForBoot(self, bootTimeout, pollInterval=0.1):
+        """Opening the port resets the Arduino. Rather than sleeping for the worst case boot time,
+        poll the identity until the firmware answers. Returns the identity string"""
+        port = self.transport.port
+        timeout = port.timeout
+        port.timeout = pollInterval
+        try:
+            deadline = time.monotonic() + bootTimeout
+            while time.monotonic() < deadline:
+                ident = self._identity()
+                if ident:
+                    # Throw away any replies to earlier queries that were still in flight
+                    time.sleep(pollInterval)
+                    self.transport.reset_input()
+                    return ident
+        finally:
+            port.timeout = timeout
+        raise IOError("ArduinoDDS did not respond within {} s of connecting".format(bootTimeout))
     
     
     def send(self, data):
-        self.ser.write(data.encode())
+        self.transport.write(data)
 
     
-    def setProfile(self, profile, freq, phase=0.0, amp=1.0):
+    async def setProfile(self, profile, freq, phase=0.0, amp=1.0):
         """Sets a DDS profile frequency (Hz), phase (degrees), and amplitude (full-scale).
         phase defaults to 0 and amplitude defaults to 1"""
         if amp < 0 or amp > 1:
@@ -47,10 +79,10 @@ class ArduinoDds:
         ampWord = int(round( amp / self.lsbAmp ))
         phaseWord = int(round( (phase % 360.0) / self.lsbPhase ))
         freqWord = int(round( freq / self.lsbFreq ))
-        self.setProfileLSB(profile, freqWord, phaseWord, ampWord)
+        await self.setProfileLSB(profile, freqWord, phaseWord, ampWord)
         
     
-    def setProfileLSB(self, profile, freq, phase, amp): # Freq, phase, amp are all in units of lsb
+    async def setProfileLSB(self, profile, freq, phase, amp): # Freq, phase, amp are all in units of lsb
         if profile < 0 or profile > 7 or not isinstance(profile, int):
             raise ValueError("DDS profile should be an integer between 0 and 7")
         if amp > 0x3fff or amp < 0 or not isinstance(amp, int):
@@ -60,15 +92,45 @@ class ArduinoDds:
         if freq < 0 or freq > 0xffffffff or not isinstance(freq, int):
             raise ValueError("DDS frequency word should be an integer between 0 and 0xffffffff")
         
-        self.send('PLSB {} {} {} {}\n'.format( profile, amp, phase, freq) );
-        time.sleep(0.01)
+        if self.profileCache.get(profile) == (freq, phase, amp):
+            self.profileCacheHits += 1
+            return
+        self.profileCacheMisses += 1
+        
+        # Only cache the words once they have been written (and acknowledged), so that a
+        # failed write is retried, and a concurrent identical call writes them too
+        self.profileCache.pop(profile, None)
+        await self.transport.call_async(self._writeProfile, 'PLSB {} {} {} {}\n'.format( profile, amp, phase, freq))
+        self.profileCache[profile] = (freq, phase, amp)
 
-    def reset(self):
-        self.send("reset\n")
+    def _writeProfile(self, cmd):
+        """Sends a PLSB command and waits until the firmware is ready for the next one"""
+        if self.acknowledged:
+            if not self.transport.query(cmd):
+                raise IOError("Timeout waiting for ArduinoDDS to acknowledge PLSB")
+        else:
+            self.send(cmd)
+            time.sleep(0.01)
+
+    async def reset(self):
+        self.invalidateProfileCache()
+        await self.transport.write_async("reset\n")
+
+    def invalidateProfileCache(self):
+        """Forget the cached profile words, so that the next write to every profile is sent.
+        Call this if the device may have been reset or power cycled behind our back"""
+        self.profileCache = {}
+
+    def getProfileCacheStats(self):
+        """Returns a dictionary of profile cache hits (skipped writes) and misses (sent writes)"""
+        return {'hits': self.profileCacheHits, 'misses': self.profileCacheMisses}
         
+    @transaction
     def identity(self):
-        self.send("*IDN?\n")
-        return self.ser.readline().decode().strip()
+        return self._identity()
+
+    def _identity(self):
+        return self.transport.query("*IDN?\n").strip()
 
     def ping(self):
         return True
@@ -90,6 +152,12 @@ class ArduinoDdsSim:
 
     def reset(self):
         pass
+
+    def invalidateProfileCache(self):
+        pass
+
+    def getProfileCacheStats(self):
+        return {'hits': 0, 'misses': 0}
         
     def identity(self):
         return "ident"
@@ -1,20 +1,27 @@
-from artiq.language.core import *
+from artiqDrivers.frequencyChain import FrequencyChain
 
 
 class UwaveDdsWrapper:
     """Wraps an Arduino DDS class to allow profiles to be set in logical frequencies (detunings from zero field) rather than the physical frequencies that are the input to the mixup chain"""
-    def __init__(self, dmgr, device, LOfrequency):
+    def __init__(self, dmgr, device, LOfrequency=None, zeroFieldFrequency=3225.6082864e6, chain=None):
+        """LOfrequency : frequency the DDS output is mixed down from. Required unless chain
+            is given
+        zeroFieldFrequency : S1/2 F=4 - F=3 splitting at zero field, Hz
+        chain : optional frequency chain stage (see artiqDrivers.frequencyChain) replacing
+            the one made from LOfrequency and zeroFieldFrequency"""
         self.core = dmgr.get("core")
 
         self.dds = dmgr.get(device)
 
-        zeroFieldFrequency = 3225.6082864e6 # S1/2 F=4 - F=3 splitting at zero field, Hz
-        
-        # To get the DDS frequency, subtract off target frequency from this offset frequency
-        self.offsetFrequency = - LOfrequency + zeroFieldFrequency
+        if chain is None:
+            if LOfrequency is None:
+                raise ValueError("UwaveDdsWrapper needs either LOfrequency or chain")
+            # The DDS frequency is the detuning plus the zero field splitting, less the LO
+            chain = {'offset': LOfrequency - zeroFieldFrequency}
+        self.chain = FrequencyChain({'uwave': chain})
     
 
     def setProfile(self, profile, freq, phase=0.0, amp=1.0):
-        freqDDS = self.offsetFrequency + freq
+        _, freqDDS, phaseScale = self.chain.toPhysical('uwave', freq)
         
-        self.dds.setProfile(profile, freqDDS, phase, amp)
+        self.dds.setProfile(profile, float(freqDDS), phase*phaseScale, amp)
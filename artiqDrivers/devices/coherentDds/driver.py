@@ -1,13 +1,16 @@
 import logging
 import serial
 import math
+import time
+
+from artiqDrivers.serialTransport import SerialTransport, transaction
 
 
 logger = logging.getLogger(__name__)
 
 
 class CoherentDds:
-    ser = None;
+    transport = None;
     lsbAmp = 1.0 / 16383 # 0x3fff is maximum amplitude
     lsbPhase = 360.0 / 65536 # Degrees per LSB.
   
@@ -15,26 +18,33 @@ class CoherentDds:
         # addr : serial port name
         # clockFreq : clock frequency in Hz
         
-        self.ser = serial.Serial(addr, baudrate=115200)
+        self.transport = SerialTransport(serial.Serial(addr, baudrate=115200), timeout=1.0)
         self.lsbFreq = clockFreq / (2**32);
         self.clockFreq = clockFreq
-
+        
+        # Shadow copy of the (freq, phase, amp) words loaded in each (channel, profile),
+        # used to skip writes that would not change anything
+        self.profileCache = {}
+        self.profileCacheHits = 0
+        self.profileCacheMisses = 0
         
         # Write a trivial pulse shape to /disable/ pulse shaping (the VGA is always at max)
-        self.setPulseShape(0, [1]);
+        self.send(self._pulseShapeCommand(0, [1]));
     
     def send(self, data):
-        self.ser.write(data.encode())
+        self.transport.write(data)
     
+    @transaction
     def identity(self):
         """Returns a string representing the firmware name and version"""
-        self.send('idn?\n')
-        return self.ser.readline().decode().strip()
+        return self.transport.query('idn?\n').strip()
         
     
+    @transaction
     def resetPhase(self):    
         self.send('resetPhase\n');
     
+    @transaction
     def setProfile(self, channel, profile, freq, phase=0.0, amp=1.0):
         """Sets a DDS profile frequency (Hz), phase (degrees), and amplitude (full-scale).
         phase defaults to 0 and amplitude defaults to 1"""
@@ -46,9 +56,13 @@ class CoherentDds:
         ampWord = int(round( amp * 0x3fff ))
         phaseWord = int(round( (phase % 360) / 360.0 * 0xffff ))
         freqWord = int(round( freq / self.lsbFreq ))
-        self.setProfileWords(channel, profile, freqWord, phaseWord, ampWord)
+        self._setProfileWords(channel, profile, freqWord, phaseWord, ampWord)
     
+    @transaction
     def setProfileWords(self, channel, profile, freq, phase, amp): # Freq, phase, amp are all in units of lsb
+        self._setProfileWords(channel, profile, freq, phase, amp)
+    
+    def _setProfileWords(self, channel, profile, freq, phase, amp):
         profile = int(profile) # have to do this, because artiq uses a special artiq.integer
         if channel < 0 or channel > 3 or not isinstance(channel, int):
             raise ValueError("DDS channel should be an integer between 0 and 3")
@@ -61,31 +75,131 @@ class CoherentDds:
         if freq < 0 or freq > 0xffffffff or not isinstance(freq, int):
             raise ValueError("DDS frequency word should be an integer between 0 and 0xffffffff")
         
-        self.send('setProfile {} {} {} {} {}\n'.format( channel, profile, freq, phase, amp) );
-
+        if not self._profileCached(channel, profile, (freq, phase, amp)):
+            self.send('setProfile {} {} {} {} {}\n'.format( channel, profile, freq, phase, amp) );
+            self.profileCache[(channel, profile)] = (freq, phase, amp)
+
+    @transaction
+    def setProfiles(self, profiles):
+        """Sets several DDS profiles in one go.
+        profiles is a list of (channel, profile, freq, phase, amp) tuples, with freq in Hz,
+        phase in degrees and amp in full-scale, as for setProfile. The whole table is
+        validated before anything is sent, so either all profiles are written or none are."""
+        import numpy as np
+        table = self._profileTable(np.array(profiles, dtype=float))
+        channels, profileNums, freqs, phases, amps = table.T
+
+        # Check before the cast to integer words, which would silently truncate them. NaN
+        # fails every comparison, so would get past the range checks
+        if not np.all(np.isfinite(table)):
+            raise ValueError("DDS profile values should all be finite")
+        if np.any(channels != np.rint(channels)):
+            raise ValueError("DDS channel should be an integer between 0 and 3")
+        if np.any(profileNums != np.rint(profileNums)):
+            raise ValueError("DDS profile should be an integer between 0 and 7")
+        if np.any((amps < 0) | (amps > 1)):
+            raise ValueError("DDS amplitude must be between 0 and 1")
+        if np.any((freqs < 0) | (freqs > 450e6)): # This should be dependant on the clock frequency
+            raise ValueError("DDS frequency must be between 0 and 450 MHz")
+        
+        words = np.column_stack((
+            channels,
+            profileNums,
+            np.rint( freqs / self.lsbFreq ),
+            np.rint( np.mod(phases, 360) / 360.0 * 0xffff ),
+            np.rint( amps * 0x3fff ) )).astype(np.int64)
+        self._setProfilesWords(words)
+    
+    @transaction
+    def setProfilesWords(self, profiles):
+        """Sets several DDS profiles in one go.
+        profiles is a list (or integer array) of (channel, profile, freq, phase, amp) tuples,
+        all in units of lsb as for setProfileWords. All profiles are sent as a single write."""
+        self._setProfilesWords(profiles)
+    
+    def _setProfilesWords(self, profiles):
+        import numpy as np
+        table = self._profileTable(np.array(profiles))
+        if table.size and table.dtype.kind not in 'iu':
+            raise ValueError("DDS profile words should all be integers")
+        channels, profileNums, freqs, phases, amps = table.T
+        
+        if np.any((channels < 0) | (channels > 3)):
+            raise ValueError("DDS channel should be an integer between 0 and 3")
+        if np.any((profileNums < 0) | (profileNums > 7)):
+            raise ValueError("DDS profile should be an integer between 0 and 7")
+        if np.any((amps < 0) | (amps > 0x3fff)):
+            raise ValueError("DDS amplitude word should be an integer between 0 and 0x3fff")
+        if np.any((phases < 0) | (phases > 0xffff)):
+            raise ValueError("DDS phase word should be an integer between 0 and 0xffff")
+        if np.any((freqs < 0) | (freqs > 0xffffffff)):
+            raise ValueError("DDS frequency word should be an integer between 0 and 0xffffffff")
+        
+        rows = [row for row in table.tolist() if not self._profileCached(row[0], row[1], tuple(row[2:]))]
+        if rows:
+            self.send(''.join( 'setProfile {} {} {} {} {}\n'.format(*row) for row in rows ))
+            for row in rows:
+                self.profileCache[(row[0], row[1])] = tuple(row[2:])
+
+    def _profileTable(self, table):
+        """Checks that an array has one (channel, profile, freq, phase, amp) row per profile"""
+        if table.size == 0:
+            return table.reshape(0, 5)
+        if table.ndim != 2 or table.shape[1] != 5:
+            raise ValueError("DDS profiles should be (channel, profile, freq, phase, amp) tuples")
+        return table
+
+    def _profileCached(self, channel, profile, words):
+        """Returns True if words are already loaded in (channel, profile), i.e. if the write can
+        be skipped. The cache is only updated once a write has been sent, so that a failed
+        write is retried"""
+        if self.profileCache.get((channel, profile)) == words:
+            self.profileCacheHits += 1
+            return True
+        self.profileCacheMisses += 1
+        return False
+
+    def invalidateProfileCache(self):
+        """Forget the cached profile words, so that the next write to every profile is sent.
+        Call this if the device may have been reset or power cycled behind our back"""
+        self.profileCache = {}
+
+    def getProfileCacheStats(self):
+        """Returns a dictionary of profile cache hits (skipped writes) and misses (sent writes)"""
+        return {'hits': self.profileCacheHits, 'misses': self.profileCacheMisses}
+
+    @transaction
     def reset(self):
+        # Runs on the transport's worker thread, so the sleep doesn't hold up the event loop
+        self.invalidateProfileCache()
         self.send('reset\n');
         time.sleep(50e-3);
 
-    def setPulseShape(self, shapeChannel, shapeVec):
+    async def setPulseShape(self, shapeChannel, shapeVec):
+        """Sets the pulse shape for a channel. shapeVec is a list or array of 1 to 2048 points
+        between 0.0 and 1.0"""
+        # The whole command goes out as a single write. A full length shape takes around a
+        # second at 115200 baud, so do it off the event loop
+        await self.transport.write_async(self._pulseShapeCommand(shapeChannel, shapeVec))
+
+    def _pulseShapeCommand(self, shapeChannel, shapeVec):
+        """Validates a pulse shape and returns the command that sets it"""
+        import numpy as np
         if shapeChannel < 0 or shapeChannel > 3 or not isinstance(shapeChannel, int):
             raise ValueError("DDS pulse shape channel should be an integer between 0 and 3")
+        shapeVec = np.asarray(shapeVec, dtype=float).ravel()
         if len(shapeVec) < 1 or len(shapeVec) > 2048:
             raise ValueError("DDS pulse shape array length should be between 1 and 2048")
+        # NaN fails every comparison, so would get past the range check below
+        if not np.all(np.isfinite(shapeVec)):
+            raise ValueError("DDS pulse shape points should all be between 0.0 and 1.0")
         
-        quantisedShapeVec = []
-        for el in shapeVec:
-            quantisedEl = round(el*0x3fff)
-            if quantisedEl < 0 or quantisedEl > 0x3fff:
-                raise ValueError("DDS pulse shape points should all be between 0.0 and 1.0")
-            quantisedShapeVec.append(quantisedEl)
+        quantisedShapeVec = np.rint(shapeVec*0x3fff)
+        if np.any((quantisedShapeVec < 0) | (quantisedShapeVec > 0x3fff)):
+            raise ValueError("DDS pulse shape points should all be between 0.0 and 1.0")
         
-        self.send('setPulseShape {}\n'.format(shapeChannel))
-        for i in range(len(quantisedShapeVec)):
-            self.send('%d' % quantisedShapeVec[i]);
-            if i != len(quantisedShapeVec)-1:
-                self.send(',');
-        self.send('\n');
+        return 'setPulseShape {}\n{}\n'.format(shapeChannel,
+            ','.join(map(str, quantisedShapeVec.astype(np.int64).tolist())))
 
     #def setSensiblePulseShape(self, duration):
     #    """Sets a sensible looking pulse shape with total duration 'duration' seconds. The duration must be between 0 and 10us"""
@@ -117,9 +231,22 @@ class CoherentDdsSim:
     def setProfileWords(self, channel, profile, freq, phase, amp): # Freq, phase, amp are all in units of lsb
         pass
 
+    def setProfiles(self, profiles):
+        for channel, profile, freq, phase, amp in profiles:
+            self.setProfile(channel, profile, freq, phase, amp)
+    
+    def setProfilesWords(self, profiles):
+        pass
+
     def reset(self):
         pass
 
+    def invalidateProfileCache(self):
+        pass
+
+    def getProfileCacheStats(self):
+        return {'hits': 0, 'misses': 0}
+
     def setPulseShape(self, shapeChannel, shapeVec):
         pass
     
@@ -1,53 +1,70 @@
-from artiq.language.core import *
+import functools
+
+from artiqDrivers.frequencyChain import FrequencyChain
 from artiqRoutines.hfQubitTransitionFreq import HfQubitTransitionFreq
 
 
 class RamanDdsWrapper:
     """Wraps a CoherentDDS class to allow profiles to be set in logical frequencies (detunings from zero field) rather than the physical frequencies that are the input to the Raman AOMs.
-    This class is very ugly at the moment as it hardcodes the arrangement of our AOM (inc. the diffraction orders)."""
-    def __init__(self, dmgr, device):
-        """LO_freq : blue beat note frequency between master and slave laser"""
+    The arrangement of the AOMs (offsets, diffraction orders, passes and DDS ranges of each beam) is described by a frequency chain (see artiqDrivers.frequencyChain), which can be given in the device database."""
+    # Our AOM arrangement. Rh (-1st order at 109MHz) is common to both beams, rPara is double
+    # passed +1,+1 and rV is -1st order
+    defaultChain = {
+        'rPara': {'dds': 0, 'offset': -109e6, 'order': 1, 'passes': 2, 'range': [170e6,220e6]},
+        'rV': {'dds': 1, 'offset': -109e6, 'order': -1, 'passes': 1, 'range': [105e6,113e6]},
+    }
+    
+    def __init__(self, dmgr, device, chain=None, msDiff=3.2e9):
+        """chain : dictionary of beam name to frequency chain stage, defaults to defaultChain
+        msDiff : master-slave Raman laser frequency difference"""
         self.core = dmgr.get("core")
 
         self.dds = dmgr.get(device)
         
         self.hfq = HfQubitTransitionFreq()
         
-        self.msDiff = 3.2e9 # master-slave Raman laser frequency difference
+        self.msDiff = msDiff # master-slave Raman laser frequency difference
         self.trans = 't4030' # hyperfine transition without Zeeman shift
         self.hfs = self.hfq.dfTrans(0,int(self.trans[2]),int(self.trans[4])) # hyperfinesplitting, independent of B
-        self.rH_freq = -109e6 # frequency of Rh, is -1st order
         
-        # range of sensible frequencies for rPara and rV        
-        self.rParaRange = [170e6,220e6]
-        self.rVRange = [105e6,113e6]
+        self.chain = FrequencyChain(self.defaultChain if chain is None else chain)
+        
+        # Single detunings tend to be set over and over, so remember their conversions
+        self._ddsFrequency = functools.lru_cache(maxsize=1024)(self._ddsFrequencyUncached)
     
 
     def setProfile(self, channel, profile, freq, phase=0.0, amp=1.0, addQubitFreq = True):
-        ''' channnel: rPara or rV, profile: 0...7, if addQubitFreq=True: the lasers used to create the frequency difference are split by 3.2GHz '''
-        if addQubitFreq:
-            freqDDS = self.msDiff-self.rH_freq-freq
-        else:
-            freqDDS = freq - self.rH_freq
+        ''' channnel: a beam of the chain (rPara or rV), profile: 0...7, if addQubitFreq=True: the lasers used to create the frequency difference are split by msDiff (3.2GHz) '''
+        ddsChannel, freqDDS, phaseScale = self._ddsFrequency(channel, float(freq), addQubitFreq)
+        self.dds.setProfile(ddsChannel, profile, freqDDS, phase=phase*phaseScale, amp=amp)
+
+    def setProfiles(self, channel, freqs, profiles=None, phases=0.0, amps=1.0, addQubitFreq=True):
+        ''' Sets several profiles of one channel (a beam of the chain) in one go. freqs is a list or array
+        of logical frequencies, one per profile. profiles defaults to 0, 1, 2...; phases and amps
+        are either one value for all profiles or one per profile. All frequencies are checked
+        before anything is sent, and the DDS is sent the whole table in one call '''
+        import numpy as np
+        freqs = np.asarray(freqs, dtype=float).ravel()
+        if profiles is None:
+            profiles = np.arange(len(freqs))
+        profiles = np.asarray(profiles).ravel()
+        if len(profiles) != len(freqs):
+            raise ValueError("Need one profile number per frequency")
         
-        if channel == 'rPara':
-            # rPara is double passed +1,+1
-            freqDDS /= 2
-            phase /= 2
-            if (freqDDS<self.rParaRange[0]) or (freqDDS>self.rParaRange[1]):
-                raise ValueError("Rpara frequency out of range, {:.0f}MHz not in [{:.0f},{:.0f}]MHz".format(freqDDS/1e6,self.rParaRange[0]/1e6,self.rParaRange[1]/1e6))
-            else:
-                print('Profile:',profile)
-                print(type(profile))
-                self.dds.setProfile(0, profile, freqDDS, phase=phase, amp=amp)
-            
-        elif channel == 'rV':
-            # rV is -1st order  
-            freqDDS *= -1     
-            if (freqDDS<self.rVRange[0]) or (freqDDS>self.rVRange[1]):
-                raise ValueError("Rpara frequency out of range, {:.0f}MHz not in [{:.0f},{:.0f}]MHz".format(freqDDS/1e6,self.rVRange[0]/1e6,self.rVRange[1]/1e6))
-            else:
-                self.dds.setProfile(1, profile, freqDDS, phase=phase, amp=amp)
-            
-        else:
-            raise ValueError("Channel can only be rPara or rV")
+        ddsChannel, freqsDDS, phaseScale = self._ddsFrequencies(channel, freqs, addQubitFreq)
+        phases = np.broadcast_to(np.asarray(phases, dtype=float)*phaseScale, freqs.shape)
+        amps = np.broadcast_to(np.asarray(amps, dtype=float), freqs.shape)
+        self.dds.setProfiles([(ddsChannel, int(p), float(f), float(ph), float(a))
+                              for p, f, ph, a in zip(profiles, freqsDDS, phases, amps)])
+
+    def _ddsFrequencyUncached(self, channel, freq, addQubitFreq):
+        ddsChannel, freqDDS, phaseScale = self._ddsFrequencies(channel, freq, addQubitFreq)
+        return ddsChannel, float(freqDDS), phaseScale
+
+    def _ddsFrequencies(self, channel, freqs, addQubitFreq):
+        ''' Converts logical frequencies (a number or an array) to DDS frequencies.
+        Returns the DDS channel, the DDS frequencies, and the factor to scale phases by '''
+        if addQubitFreq:
+            # The chain works on the frequency difference of the beams
+            freqs = self.msDiff - freqs
+        return self.chain.toPhysical(channel, freqs)
@@ -1,16 +1,18 @@
 from driver import *
+import asyncio
 
 
 dev = CoherentDds('/dev/milldown_1', 1e9)
+run = asyncio.get_event_loop().run_until_complete
 
 for i in range(8):
-    dev.setProfile(0, i, 200e6)
-    dev.setProfile(1, i, 200e6)
-dev.setProfile(3, 0, 38.5e6)
-dev.resetPhase()
+    run(dev.setProfile(0, i, 200e6))
+    run(dev.setProfile(1, i, 200e6))
+run(dev.setProfile(3, 0, 38.5e6))
+run(dev.resetPhase())
 
 
 
-print("ID : {}".format(dev.identity()))
+print("ID : {}".format(run(dev.identity())))
 
 print("All done")
\ No newline at end of file
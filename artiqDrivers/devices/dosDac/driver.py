@@ -2,6 +2,9 @@ import logging
 import serial
 import time
 
+from artiqDrivers.rampScheduler import RampScheduler
+from artiqDrivers.serialTransport import SerialTransport
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,41 +19,56 @@ class DosDac:
         '850freq': 10
     }
     
-    def __init__(self, addr):
-        self.dev = DosDacInterface(addr)
-        
-        self.currentValues = [self.getDac(self.dacMap[dacName]) for dacName in self.dacMap]
+    slowScanStep = 50 # Largest single step in mV for slow-scanned channels
+    slowScanInterval = 50e-3 # Time between slow-scan steps in seconds
     
+    def __init__(self, addr, timeout=1.0):
+        # timeout : time in seconds to wait for the DAC to answer a readback
+        self.dev = DosDacInterface(addr, timeout)
+        
+        # Last value written to each channel, keyed by channel number
+        self.currentValues = self.dev.getDacs(sorted(self.dacMap.values()))
+        self.ramps = RampScheduler(self._writeDac, self.slowScanInterval)
     
-    def setDac(self, channel, value):
+    def _channelNum(self, channel):
         if isinstance(channel,int):
-            channelNum = channel
+            return channel
         elif channel in self.dacMap:
-            channelNum = self.dacMap[channel]
+            return self.dacMap[channel]
         else:
             raise ValueError("DAC channel must either be a valid channel name or a channel number")
+    
+    async def _writeDac(self, channelNum, value):
+        await self.dev.transport.call_async(self.dev.setDac, channelNum, value)
+        self.currentValues[channelNum] = value
+    
+    async def setDac(self, channel, value, wait=True):
+        """Sets a DAC channel to value in mV.
+        Channels other than Btrim are slow-scanned to the new value in the background. If wait is
+        False this returns as soon as the scan has started; use waitDac or getDacProgress to follow
+        it. Setting a channel that is still scanning redirects the scan to the new value"""
+        channelNum = self._channelNum(channel)
         # Should check for validity of 'value' here
         
-        # The following is a hacky 'slow-scan'
-        if channelNum != 0: # Exclude Btrim
-            currentVal = self.currentValues[self.dacMap[channel]]
-            sign = (currentVal-value) / abs(currentVal-value)
-            while abs(currentVal-value) > 50:
-                currentVal -= sign*50
-                self.dev.setDac(channelNum,int(currentVal))
-                time.sleep(50e-3)
-                
-        self.currentValues[self.dacMap[channel]] = int(value)
-        self.dev.setDac(channelNum,int(value))
+        if channelNum == 0 or channelNum not in self.currentValues: # Exclude Btrim
+            await self._writeDac(channelNum, int(value))
+            return
+        
+        self.ramps.ramp(channelNum, self.currentValues[channelNum], int(value), self.slowScanStep)
+        if wait:
+            await self.ramps.wait(channelNum)
     
-    def getDac(self,channel):
-        if isinstance(channel,int):
-            channelNum = channel
-        elif channel in self.dacMap:
-            channelNum = self.dacMap[channel]
-        else:
-            raise ValueError("DAC channel must either be a valid channel name or a channel number")
-        return self.dev.getDac(channelNum)
+    async def waitDac(self, channel):
+        """Waits until a channel has finished slow-scanning"""
+        await self.ramps.wait(self._channelNum(channel))
+    
+    def getDacProgress(self, channel):
+        """Returns a dictionary with the last written ('current') and target values of a channel,
+        and whether it is still slow-scanning ('ramping')"""
+        return self.ramps.progress(self._channelNum(channel))
+    
+    async def getDac(self,channel):
+        return await self.dev.transport.call_async(self.dev.getDac, self._channelNum(channel))
 
     def ping(self):
         return True
@@ -75,9 +93,15 @@ class DosDacSim:
     def __init__(self):
         pass
     
-    def setDac(self, channel, value):
+    def setDac(self, channel, value, wait=True):
         pass
     
+    def waitDac(self, channel):
+        pass
+    
+    def getDacProgress(self, channel):
+        return {'current': 666, 'target': 666, 'ramping': False}
+    
     def getDac(self,channel):
         return 666
 
@@ -89,19 +113,39 @@ class DosDacSim:
 
 # The direct hardware interface class
 class DosDacInterface:
-    def __init__(self, addr):
-        self.ser = serial.Serial(addr, baudrate=115200)
+    def __init__(self, addr, timeout=1.0):
+        self.timeout = timeout
+        self.transport = SerialTransport(serial.Serial(addr, baudrate=115200), timeout=timeout)
     
     def setDac(self, channel, value): # Sets a given DAC to a given value in mV
         if channel < 0 or channel > 10 or not isinstance(channel,int):
             raise ValueError("DAC channel must be a number between 0 and 10")
-        self.ser.write('S {:02} {}\n'.format(channel,int(value)).encode())
+        self.transport.write('S {:02} {}\n'.format(channel,int(value)))
         
     def getDac(self, channel):
-        self.ser.flushInput()
         if channel < 0 or channel > 10 or not isinstance(channel,int):
             raise ValueError("DAC channel must be a number between 0 and 10")
-        self.ser.write('G {:02}\n'.format(channel).encode())
-        return int(self.ser.readline().decode())
+        return self.getDacs([channel])[channel]
+    
+    def getDacs(self, channels):
+        """Reads back several DAC channels, sending all the queries in one write.
+        Returns a dictionary of values in mV keyed by channel number. Raises IOError if
+        the replies have not all arrived within the timeout"""
+        for channel in channels:
+            if channel < 0 or channel > 10 or not isinstance(channel,int):
+                raise ValueError("DAC channel must be a number between 0 and 10")
+        with self.transport.lock:
+            self.transport.reset_input()
+            self.transport.write(''.join('G {:02}\n'.format(channel) for channel in channels))
+            # The replies come back in order, one line each
+            deadline = time.monotonic() + self.timeout
+            values = {}
+            for channel in channels:
+                line = self.transport.read_line(timeout=max(0, deadline - time.monotonic()))
+                if not line.endswith('\n'):
+                    raise IOError("Timeout reading back DAC channel {}, got {} of {} replies".format(
+                        channel, len(values), len(channels)))
+                values[channel] = int(line)
+        return values
     
     
\ No newline at end of file
@@ -6,29 +6,72 @@ logger = logging.getLogger(__name__)
 
 
 class RohdeSynth:
+    triggerSources = ["AUTO", "SING", "EXT"]
+    listName = "artiq"
 
-    def __init__(self, addr):
+    def __init__(self, addr, timeout=5.0, port=5025):
         # addr : IP address of synth
+        # timeout : socket timeout in seconds
+        # port : SCPI socket port
         self.addr = addr
-        self.port = 5025
+        self.port = port
+        self.timeout = timeout
         
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((self.addr, self.port))
+        self.sock = None
+        self.connect()
         logger.info("Connected to RohdeSynth with ID '{}'".format(self.identity()))
         self.sanity()
 
+    def connect(self):
+        """(Re)open the connection to the synth"""
+        self.close()
+        self.sock = socket.create_connection((self.addr, self.port), self.timeout)
+        # Commands are small and mostly followed by a query, so don't let Nagle hold them back
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # One buffered reader for the lifetime of the connection, so that no
+        # received data is lost between queries
+        self.reader = self.sock.makefile('rb')
+
     def close(self):
-        self.sock.close()
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
         self.sock = None
+        self.reader = None
+
+    def _reconnecting(self, fn, *args):
+        """Call fn, reconnecting and retrying once if the connection has failed"""
+        try:
+            return fn(*args)
+        except OSError:
+            logger.warning("Connection to RohdeSynth lost, reconnecting", exc_info=True)
+            self.connect()
+            return fn(*args)
+
+    def _send(self, data):
+        self.sock.sendall(data.encode())
+
+    def _query(self, data):
+        self._send(data)
+        response = self.reader.readline()
+        if not response:
+            raise ConnectionError("RohdeSynth closed the connection")
+        return response.decode().strip()
 
     def send(self, data):
-        self.sock.send(data.encode())
+        self._reconnecting(self._send, data)
 
     def query(self, data):
-        self.send(data)
-        with self.sock.makefile() as f:
-            response = f.readline().strip()
-        return response
+        return self._reconnecting(self._query, data)
+
+    def query_many(self, queries):
+        """Send several queries (e.g. ["FREQ?", "POW?", "OUTP?"]) in one
+        message and return the list of responses, in one network round trip"""
+        response = self.query(";:".join(q.strip() for q in queries) + "\n")
+        responses = response.split(";")
+        if len(responses) != len(queries):
+            raise Exception("Expected {} responses, got '{}'".format(len(queries), response))
+        return responses
 
     def sanity(self):
         """
@@ -60,12 +103,25 @@ class RohdeSynth:
         """Turn RF output on or off with boolean value"""
         self.send("OUTP {}\n".format("ON" if on else "OFF"))
 
-    def setFrequency(self, frequency):
-        """Set frequency in Hz"""
+    def _checkFrequency(self, frequency):
         if frequency < 9e3 or frequency > 3e9:
             msg = "Frequency '{}' invalid: should be a float between 9kHz and 3GHz"
             raise ValueError(msg.format(frequency))
 
+    def _checkPower(self, power):
+        if power < -120 or power > 20:
+            msg = "Power '{}' invalid: should be a float between -120dBm and +20dBm"
+            raise ValueError(msg.format(power))
+
+    def _checkTrigger(self, trigger):
+        if trigger not in self.triggerSources:
+            msg = "Trigger source '{}' invalid: should be one of {}"
+            raise ValueError(msg.format(trigger, self.triggerSources))
+
+    def setFrequency(self, frequency):
+        """Set frequency in Hz"""
+        self._checkFrequency(frequency)
+
         self.send("FREQ {}\n".format(frequency))
 
     def frequency(self):
@@ -75,9 +131,7 @@ class RohdeSynth:
 
     def setPower(self, power):
         """Set power level in dBm"""
-        if power < -120 or power > 20:
-            msg = "Power '{}' invalid: should be a float between -120dBm and +20dBm"
-            raise ValueError(msg.format(power))
+        self._checkPower(power)
 
         self.send("POW {}\n".format(power))
 
@@ -85,6 +139,104 @@ class RohdeSynth:
         """Query power in dBm"""
         return float(self.query("POW?\n"))
         
+    def status(self):
+        """Query frequency (Hz), power (dBm), and whether RF output is on, in
+        one round trip"""
+        freq, power, output = self.query_many(["FREQ?", "POW?", "OUTP?"])
+        return {"frequency": float(freq), "power": float(power),
+                "rfOutput": output == "1"}
+
+    def setFixedMode(self):
+        """Leave list / sweep mode, so that the output is set by setFrequency
+        and setPower again"""
+        self.send("FREQ:MODE FIX\n")
+        self.send("POW:MODE FIX\n")
+
+    def setFrequencyList(self, frequencies, powers=None, dwell=1e-3, trigger="EXT"):
+        """Upload a list of frequencies (Hz), and optionally powers (dBm, one
+        per frequency), and switch to list mode. Without powers, every point
+        is at the current power level.
+
+        With trigger "EXT" or "SING" the list advances one point per trigger;
+        with "AUTO" it runs continuously, spending 'dwell' seconds per point.
+        All points are checked before anything is sent."""
+        if len(frequencies) < 1:
+            raise ValueError("Frequency list must not be empty")
+        for frequency in frequencies:
+            self._checkFrequency(frequency)
+        if powers is not None:
+            if len(powers) != len(frequencies):
+                raise ValueError("Need one power per frequency in the list")
+            for power in powers:
+                self._checkPower(power)
+        self._checkTrigger(trigger)
+        if powers is None:
+            # The list needs a level per point, and one left over from an
+            # earlier list may not match this one
+            powers = [self.power()] * len(frequencies)
+
+        self.send("LIST:SEL \"{}\"\n".format(self.listName))
+        self.send("LIST:FREQ {}\n".format(", ".join(str(f) for f in frequencies)))
+        self.send("LIST:POW {}\n".format(", ".join(str(p) for p in powers)))
+        self.send("LIST:DWEL {}\n".format(dwell))
+        self.send("LIST:MODE {}\n".format("AUTO" if trigger == "AUTO" else "STEP"))
+        self.send("LIST:TRIG:SOUR {}\n".format(trigger))
+        self.send("FREQ:MODE LIST\n")
+        self.send("LIST:RES\n")
+        # Wait until the instrument has processed the list
+        self.query("*OPC?\n")
+
+    def setFrequencySweep(self, start, stop, points, dwell=1e-3, trigger="EXT"):
+        """Set up a linear frequency sweep from start to stop (Hz) over
+        'points' points, and switch to sweep mode.
+
+        With trigger "EXT" the sweep advances one step per trigger; with
+        "AUTO" it runs continuously, spending 'dwell' seconds per point."""
+        self._checkFrequency(start)
+        self._checkFrequency(stop)
+        if points < 2:
+            raise ValueError("A sweep needs at least 2 points")
+        self._checkTrigger(trigger)
+
+        self.send("FREQ:STAR {}\n".format(start))
+        self.send("FREQ:STOP {}\n".format(stop))
+        self.send("SWE:FREQ:SPAC LIN\n")
+        self.send("SWE:FREQ:POIN {}\n".format(int(points)))
+        self.send("SWE:FREQ:DWEL {}\n".format(dwell))
+        self.send("SWE:FREQ:MODE {}\n".format("AUTO" if trigger == "AUTO" else "STEP"))
+        self.send("TRIG:FSW:SOUR {}\n".format(trigger))
+        self.send("FREQ:MODE SWE\n")
+        self.send("SWE:FREQ:RES\n")
+        self.query("*OPC?\n")
+
+    def setPowerSweep(self, start, stop, points, dwell=1e-3, trigger="EXT"):
+        """Set up a power sweep from start to stop (dBm) over 'points' points,
+        and switch to sweep mode. Triggering is as for setFrequencySweep."""
+        self._checkPower(start)
+        self._checkPower(stop)
+        if points < 2:
+            raise ValueError("A sweep needs at least 2 points")
+        self._checkTrigger(trigger)
+
+        self.send("POW:STAR {}\n".format(start))
+        self.send("POW:STOP {}\n".format(stop))
+        self.send("SWE:POW:POIN {}\n".format(int(points)))
+        self.send("SWE:POW:DWEL {}\n".format(dwell))
+        self.send("SWE:POW:MODE {}\n".format("AUTO" if trigger == "AUTO" else "STEP"))
+        self.send("TRIG:PSW:SOUR {}\n".format(trigger))
+        self.send("POW:MODE SWE\n")
+        self.send("SWE:POW:RES\n")
+        self.query("*OPC?\n")
+
+    def resetSweep(self):
+        """Return list and sweeps to their first point"""
+        self.send("LIST:RES\n")
+        self.send("SWE:RES:ALL\n")
+
+    def frequencyMode(self):
+        """Query frequency mode, one of 'CW' (fixed), 'SWE' or 'LIST'"""
+        return self.query("FREQ:MODE?\n")
+
     def identity(self):
         return self.query("*IDN?\n")
 
@@ -111,6 +263,27 @@ class RohdeSynthSim:
     def power(self):
         return -42
 
+    def status(self):
+        return {"frequency": 666e6, "power": -42, "rfOutput": True}
+
+    def setFixedMode(self):
+        pass
+
+    def setFrequencyList(self, frequencies, powers=None, dwell=1e-3, trigger="EXT"):
+        pass
+
+    def setFrequencySweep(self, start, stop, points, dwell=1e-3, trigger="EXT"):
+        pass
+
+    def setPowerSweep(self, start, stop, points, dwell=1e-3, trigger="EXT"):
+        pass
+
+    def resetSweep(self):
+        pass
+
+    def frequencyMode(self):
+        return "CW"
+
     def identity(self):
         return "RohdeSynthSim"
 
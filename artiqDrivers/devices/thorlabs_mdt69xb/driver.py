@@ -4,93 +4,116 @@ import re
 import sys
 import asyncio
 
-import artiq.protocols.pyon as pyon
+from artiqDrivers.coalescingQueue import CoalescingQueue
+from artiqDrivers.rampScheduler import RampScheduler
+from artiqDrivers.serialTransport import SerialTransport, transaction
+from artiqDrivers.setpointJournal import SetpointJournal
 
 logger = logging.getLogger(__name__)
 
+# Identity paragraphs already read, keyed by serial port name. The identity
+# of a device can't change while it is connected, and reading it is slow
+_identities = {}
+
 class PiezoController:
     """Driver for Thorlabs MDT693B 3 channel open-loop piezo controller."""
+    # Last line of the identity paragraph, which is followed by one blank line
+    id_end_marker = "www.thorlabs.com"
+    # Gap after which we assume the device has finished sending a paragraph
+    idle_gap = 0.02
     def __init__(self, serial_addr):
+        # Writes may happen on the transport's worker thread, so keep hold of the loop
+        self.loop = asyncio.get_event_loop()
         if serial_addr is None:
             self.simulation = True
+            self.transport = None
         else:
             self.simulation = False
-            self.port = serial.Serial(
-                serial_addr,
-                baudrate=115200,
-                timeout=0.1,
-                write_timeout=0.1)
+            self.transport = SerialTransport(
+                serial.Serial(
+                    serial_addr,
+                    baudrate=115200,
+                    write_timeout=0.1),
+                terminator=b'\r',
+                timeout=0.1)
             self._purge()
 
         self.echo = None
         self._set_echo(False)
-        self.vLimit = self.get_voltage_limit()
+        self.vLimit = self._get_voltage_limit()
         logger.info("Device vlimit is {}".format(self.vLimit))
 
-        self.fname = "piezo_{}.pyon".format(self.get_serial())
+        self.fname = "piezo_{}.pyon".format(self._get_serial())
+        self.journal = SetpointJournal(self.fname)
         self.channels = {'x':-1, 'y':-1, 'z':-1}
         self._load_setpoints()
 
+        self.queue = CoalescingQueue(self._write_channel, self._write_channels)
+        self.ramps = RampScheduler(self.set_channel, 0.01)
+
     def _purge(self):
         """Make sure we start from a clean slate with the controller"""
         if not self.simulation:
             # Send a carriage return to clear the controller's input buffer
-            self.port.write('\r'.encode())
+            self.transport.write('\r')
             # Read any old gibberish from input until a timeout occurs
-            c = 'c'
-            while c != '':
-                c = self.port.read().decode()
+            self.transport.drain()
             logger.info("Clean slate established")
 
     def _load_setpoints(self):
-        """Load setpoints from a file"""
-        try:
-            self.channels = pyon.load_file(self.fname)
-            logger.info("Loaded '{}', channels: {}".format(self.fname, self.channels))
-        except FileNotFoundError:
+        """Load setpoints from file, including any changes journaled since
+        the file was last saved"""
+        channels = self.journal.load()
+        if channels is None:
             logger.warning("Couldn't find '{}', no setpoints loaded".format(self.fname))
+        else:
+            self.channels.update(channels)
+            logger.info("Loaded '{}', channels: {}".format(self.fname, self.channels))
 
     def save_setpoints(self):
         """Save current set values to file"""
-        pyon.store_file(self.fname, self.channels)
+        self.journal.values.update(self.channels)
+        self.journal.compact()
         logger.info("Saved '{}', channels: {}".format(self.fname, self.channels))
 
     def close(self):
-        """Close the serial port."""
+        """Close the serial port and the setpoint journal."""
         if not self.simulation:
-            self.port.close()
+            self.transport.close()
+        self.journal.close()
 
     def _send_command(self, cmd):
+        self._send_commands([cmd])
+
+    def _send_commands(self, cmds):
+        """Send several commands back-to-back, then read off their
+        acknowledgements"""
         if self.simulation:
-            print(cmd)
+            for cmd in cmds:
+                print(cmd)
             return None
         else:
             try:
-                self.port.write((cmd+'\r').encode())
+                self.transport.write(''.join(cmd+'\r' for cmd in cmds))
             except serial.SerialTimeoutException as e:
                 logger.exception("Serial write timeout: Force exit")
                 # This is hacky but makes the server exit
-                asyncio.get_event_loop().call_soon(sys.exit, 42)
+                self.loop.call_soon_threadsafe(sys.exit, 42)
                 raise
 
-            if self.echo:
-                # Read off the echoed command to stay in sync
-                _ = self._read_line()
-            else:
-                # Read off the asterisk
-                c = self.port.read().decode()
-                if c != '*':
-                    logger.error('"{}" returned unexpected character "{}"'.format(cmd, c))
+            for cmd in cmds:
+                if self.echo:
+                    # Read off the echoed command to stay in sync
+                    _ = self._read_line()
+                else:
+                    # Read off the asterisk
+                    c = self.transport.read()
+                    if c != '*':
+                        logger.error('"{}" returned unexpected character "{}"'.format(cmd, c))
 
     def _read_line(self):
         """Read a CR terminated line. Returns '' on timeout"""
-        s = ''
-        while len(s) == 0 or s[-1] != '\r':
-            c = self.port.read().decode()
-            if c == '': # Timeout
-                break
-            s += c
-        return s
+        return self.transport.read_line()
 
     def _read_bracketed(self):
         """Reads until a string enclosed in square brackets is found, and
@@ -119,38 +142,135 @@ class PiezoController:
         # of *[Echo On] or *[Echo Off] regardless, unlike all other set
         # commands which just set the value quietly
 
+    @transaction
     def get_serial(self):
         """Returns the device serial string."""
-        id = self.get_id()
+        return self._get_serial()
+
+    def _get_serial(self):
+        id = self._get_id()
         match = re.search("Serial#:(.*)", id)
         if match:
             return match.group(1).strip()
         # If we get here we got a timeout
         raise IOError("Timeout while reading serial string")
 
-    def get_id(self):
+    @transaction
+    def get_id(self, refresh=False):
         """Returns the identity paragraph.
 
-        This includes the device model, serial number, and firmware version. 
-        This function needs to wait for a serial timeout, hence is a little 
-        slow"""
-        # Due to the crappy Thorlabs protocol (no clear finish marker) we have
-        # to wait for a timeout to ensure that we have read everything
+        This includes the device model, serial number, and firmware version.
+        The paragraph is only read from the device once per port, unless
+        'refresh' is set"""
+        return self._get_id(refresh)
+
+    def _get_id(self, refresh=False):
+        port = self.transport.port.port
+        if refresh or port not in _identities:
+            id = self._read_id()
+            # Don't remember a paragraph cut short by a timeout
+            if self.id_end_marker not in id:
+                return id
+            _identities[port] = id
+        return _identities[port]
+
+    def _read_id(self):
+        # Due to the crappy Thorlabs protocol there is no clear finish marker.
+        # Stop at the known last line of the paragraph (then read off the
+        # blank line after it), or else when the device goes quiet for
+        # idle_gap, rather than waiting for a full serial timeout
         self._send_command('id?')
         s = ''
         line = self._read_line()
         while line != '':
             s += line
-            line = self._read_line()
+            if self.id_end_marker in line:
+                self.transport.read_line(timeout=self.idle_gap)
+                break
+            line = self.transport.read_line(timeout=self.idle_gap)
+        else:
+            # Went quiet before the end of the paragraph. Discard whatever is
+            # still to come, so it isn't taken as the reply to a later command
+            self.transport.drain()
         return s.replace('\r', '\n')
 
-    def set_channel(self, channel, voltage):
-        """Set a channel (one of 'x','y','z') to a given voltage."""
+    async def set_channel(self, channel, voltage, wait=True):
+        """Set a channel (one of 'x','y','z') to a given voltage.
+
+        Setpoints are queued and written in the background. A setpoint that
+        has not been sent yet is replaced by a newer one for the same channel,
+        so the device never lags behind a fast stream of updates. If wait is
+        False this returns as soon as the setpoint is queued; use flush to
+        wait for it to be written."""
         self._check_valid_channel(channel)
         self._check_voltage_in_limit(voltage)
-        self._send_command("{}voltage={}".format( channel, voltage))
-        self.channels[channel] = voltage
+        written = self.queue.put(channel, voltage)
+        if wait:
+            await asyncio.shield(written)
 
+    async def set_channels(self, voltages, wait=True):
+        """Set several channels at once, given a dictionary of voltages keyed
+        by channel, e.g. {'x': 10, 'y': 20, 'z': 30}.
+
+        All voltages are checked before any is set, and the commands are sent
+        back-to-back. wait is as for set_channel."""
+        for channel, voltage in voltages.items():
+            self._check_valid_channel(channel)
+            self._check_voltage_in_limit(voltage)
+        written = [self.queue.put(channel, voltage) for channel, voltage in voltages.items()]
+        if wait:
+            for future in written:
+                await asyncio.shield(future)
+
+    async def flush(self, channel=None):
+        """Wait until the setpoints queued so far for a channel, or for all
+        channels if channel is None, have been written"""
+        if channel is not None:
+            self._check_valid_channel(channel)
+        await self.queue.flush(channel)
+
+    async def _write_channel(self, channel, voltage):
+        await self._write_channels({channel: voltage})
+
+    async def _write_channels(self, voltages):
+        await self._send_channels(voltages)
+        # Journal every change, so that setpoints survive a crash
+        self.journal.record(voltages)
+
+    @transaction
+    def _send_channels(self, voltages):
+        self._send_commands(["{}voltage={}".format(channel, voltage)
+                             for channel, voltage in voltages.items()])
+        self.channels.update(voltages)
+
+    async def ramp_channel(self, channel, voltage, step, wait=True):
+        """Ramp a channel to a given voltage in steps of at most 'step' volts.
+
+        The ramp runs in the background. If wait is False this returns as soon
+        as it has started; use wait_channel or get_ramp_progress to follow it.
+        Ramping a channel that is already ramping redirects the ramp to the
+        new voltage."""
+        self._check_valid_channel(channel)
+        self._check_voltage_in_limit(voltage)
+        current = self.channels[channel]
+        if current < 0:
+            raise ValueError("Channel '{}' has no setpoint to ramp from".format(channel))
+        self.ramps.ramp(channel, current, voltage, step)
+        if wait:
+            await self.ramps.wait(channel)
+
+    async def wait_channel(self, channel):
+        """Wait until a channel has finished ramping"""
+        self._check_valid_channel(channel)
+        await self.ramps.wait(channel)
+
+    def get_ramp_progress(self, channel):
+        """Returns a dictionary with the last set ('current') and target
+        voltages of a channel, and whether it is still ramping ('ramping')"""
+        self._check_valid_channel(channel)
+        return self.ramps.progress(channel)
+
+    @transaction
     def get_channel_output(self, channel):
         """Returns the current *output* voltage for a given channel.
 
@@ -165,9 +285,13 @@ class PiezoController:
         self._check_valid_channel(channel)
         return self.channels[channel]
 
+    @transaction
     def get_voltage_limit(self):
         """Returns the output limit setting in Volts (one of 75V, 100V, 150V, set by
         the switch on the device back panel)"""
+        return self._get_voltage_limit()
+
+    def _get_voltage_limit(self):
         str = self._send_command("vlimit?")
         return float( self._read_bracketed() )
 
@@ -182,6 +306,7 @@ class PiezoController:
         if voltage > self.vLimit or voltage < 0:
             raise ValueError("Voltage must be between 0 and vlimit={}".format(self.vLimit))
 
+    @transaction
     def ping(self):
-        self.get_voltage_limit()
+        self._get_voltage_limit()
         return True
@@ -1,7 +1,3 @@
-from artiq.language.core import *
-import numpy as np
-import time
-
 class PiezoWrapper:
     """
     Wraps multiple piezo controllers to allow reference to channels by an
@@ -18,10 +14,18 @@ class PiezoWrapper:
         
         self.mappings = mappings
         self.slow_scan = slow_scan
+        # Voltage limit of each controller. It is set by a switch on the back panel, so
+        # is only read once
+        self.vLimits = {}
 
-    def set_channel(self, logicalChannel, value, force=False):
+    def set_channel(self, logicalChannel, value, force=False, wait=True):
         """Set a channel to a value.
 
+        Slow scan channels are ramped by the controller in the background. If
+        'wait' is False this returns as soon as the ramp has started (or, for
+        other channels, as soon as the value is queued), so that several
+        channels can move at once; use wait_channel to wait for it.
+
         'force' flag should only be used when calibrating a slow scan
         channel"""
         # Look up device and channel
@@ -29,18 +33,59 @@ class PiezoWrapper:
 
         # Set the physical device & channel to the given value
         if logicalChannel in self.slow_scan and not force:
-            step = self.slow_scan[logicalChannel]
-            current = device.get_channel(channel)
-            if current < 0:
+            if device.get_channel(channel) < 0:
                 err_msg = "'{}' has no setpoint information. Calibrate with laser unlocked before reuse.".format(logicalChannel)
                 raise NoSetpointError(err_msg)
+            device.ramp_channel(channel, value, self.slow_scan[logicalChannel], wait)
+        else:
+            device.set_channel(channel, value, wait)
+
+    def set_channels(self, values, wait=True):
+        """Set several channels at once, given a dictionary of values keyed by
+        logical channel. The channels may be spread over several controllers.
+
+        All channels and values are checked before anything is set, so that
+        a bad value doesn't leave the others half moved. Each controller is
+        sent its values in one go, and the controllers and slow scan ramps
+        all run at the same time. 'wait' is as for set_channel."""
+        byDevice = {}
+        ramps = []
+        for logicalChannel, value in values.items():
+            (device, channel) = self._get_dev_channel(logicalChannel)
+            if channel not in ('x', 'y', 'z'):
+                raise ValueError("'{}' maps to channel '{}', must be one of 'x', 'y', or 'z'".format(
+                    logicalChannel, channel))
+            vLimit = self._get_voltage_limit(device)
+            if value < 0 or value > vLimit:
+                raise ValueError("'{}' voltage must be between 0 and vlimit={}".format(
+                    logicalChannel, vLimit))
+            if logicalChannel in self.slow_scan:
+                if device.get_channel(channel) < 0:
+                    err_msg = "'{}' has no setpoint information. Calibrate with laser unlocked before reuse.".format(logicalChannel)
+                    raise NoSetpointError(err_msg)
+                ramps.append((device, channel, value, self.slow_scan[logicalChannel]))
             else:
-                sgn = np.sign(value - current)
-                while abs(value - current) > step:
-                    current += sgn*step
-                    device.set_channel(channel, current)
-                    time.sleep(0.01)
-        device.set_channel(channel, value)
+                byDevice.setdefault(device, {})[channel] = value
+
+        for (device, channel, value, step) in ramps:
+            device.ramp_channel(channel, value, step, False)
+        for device, deviceValues in byDevice.items():
+            device.set_channels(deviceValues, False)
+        if wait:
+            for (device, channel, _, _) in ramps:
+                device.wait_channel(channel)
+            for device in byDevice:
+                device.flush()
+
+    def wait_channel(self, logicalChannel):
+        """Wait until a channel has finished ramping and its value is written"""
+        (device, channel) = self._get_dev_channel(logicalChannel)
+        device.wait_channel(channel)
+        device.flush(channel)
+
+    def get_ramp_progress(self, logicalChannel):
+        (device, channel) = self._get_dev_channel(logicalChannel)
+        return device.get_ramp_progress(channel)
 
     def get_channel_output(self, logicalChannel):
         # Look up device and channel
@@ -61,6 +106,11 @@ class PiezoWrapper:
         (dev, _) = self._get_dev_channel(logicalChannel)
         dev.save_setpoints()
 
+    def _get_voltage_limit(self, device):
+        if device not in self.vLimits:
+            self.vLimits[device] = device.get_voltage_limit()
+        return self.vLimits[device]
+
     def _get_dev_channel(self, logicalChannel):
         """Return a (device handle, channel) tuple given a logical channel"""
         # Look up the (device name, channel name) tuple in the mappings dictionary
@@ -2,6 +2,11 @@ import logging
 import serial
 import time
 import math
+import asyncio
+from collections import OrderedDict
+
+
+from artiqDrivers.serialTransport import SerialTransport
 
 
 logger = logging.getLogger(__name__)
@@ -11,31 +16,213 @@ class TrapDac:
     # [dcEcNear, dcEcFar, dopComp, sigComp, vertComp, rfAtten]
     traps = {'loading': [5.0, 5.33, 37.5, 3.0, 158.5, 9.0], 
              'tight': [107.25, 112.25, -60.0, 9.0, 105.0, 4.0] }
+    # Number of pre-rendered transport waveforms kept, least recently used are dropped first
+    transportCacheSize = 32
 
-    def __init__(self, addrDCInterface, addrRFInterface):
+    def __init__(self, addrDCInterface, addrRFInterface, configFile=None):
+        """configFile : optional pyon file with a 'mixer' matrix and/or a 'traps' dictionary
+        replacing the defaults"""
         self.dcIf = OldlabDCInterface(addrDCInterface)
         self.rfIf = OldlabRFAttenuatorInterface(addrRFInterface)
         
-    def setTrap(self, trapName):
-        """Set the DC and RF amplitudes to a given trap name"""
+        self.mixer = DcMixer()
+        if configFile is not None:
+            import artiq.protocols.pyon as pyon
+            config = pyon.load_file(configFile)
+            if 'mixer' in config:
+                self.mixer = DcMixer(config['mixer'])
+            if 'traps' in config:
+                self.traps = config['traps']
+            logger.info("Loaded trap config '{}'".format(configFile))
+        
+        # Physical DC vectors of all named traps, worked out once
+        names = sorted(self.traps)
+        physDCVectors = self.mixer.toPhysical([self.traps[name][0:5] for name in names])
+        self.physDCTraps = {name: vector.tolist() for name, vector in zip(names, physDCVectors)}
+        
+        # Pre-rendered transport waveforms, see transportTrap()
+        self.transportCache = OrderedDict()
+        self.transportTask = None
+        
+        # Name of the trap we are in, None if unknown or not a named trap
+        self.trapName = None
+        
+    writeOrders = ['parallel', 'dcFirst', 'rfFirst']
+        
+    async def setTrap(self, trapName, order='parallel'):
+        """Set the DC and RF amplitudes to a given trap name.
+        
+        By default the DC and RF writes go out at the same time on their separate ports.
+        order='rfFirst' or 'dcFirst' finishes one write before starting the other, e.g. to
+        change the RF first when lowering the confinement"""
         if trapName not in self.traps:
             raise ValueError("Given trap name not in trap list")
+        self._checkNoTransport()
+        
+        if trapName == self.trapName:
+            logger.info("Already in trap '{}'".format(trapName))
+            return
+        
+        logger.info("Setting trap '{}'".format(trapName))
+        self.trapName = None
+        await self._writeTrap(self.physDCTraps[trapName], self.traps[trapName][5], order)
+        self.trapName = trapName
+        logger.info("Trap '{}' set".format(trapName))
+        
+    def currentTrap(self):
+        """Returns the name of the trap last set, or None if the trap is not a named one"""
+        return self.trapName
+        
+    def currentVector(self):
+        """Returns the logical vector [dcEcNear, dcEcFar, dopComp, sigComp, vertComp, rfAtten]
+        last written, worked out from the values sent to the hardware. Entries that have not
+        been written yet are None"""
+        if None in self.dcIf.values:
+            dcVector = [None]*5
+        else:
+            dcVector = self.mixer.toLogical(self.dcIf.values).tolist()
+        return dcVector + [self.rfIf.getAtten()]
+        
+    def invalidateCache(self):
+        """Forget the last written values, e.g. after the hardware has been power cycled"""
+        self.trapName = None
+        self.dcIf.invalidate()
+        self.rfIf.invalidate()
         
-        physDCVector = dcMixer(self.traps[trapName][0:5])
-        rfAtten = self.traps[trapName][5]
+    async def _writeTrap(self, physDCVector, rfAtten, order='parallel'):
+        if order not in self.writeOrders:
+            raise ValueError("Write order must be one of {}".format(self.writeOrders))
         
-        print("Setting DC...")
-        self.dcIf.setAllDacChannels(physDCVector[0], physDCVector[1], physDCVector[2], physDCVector[3], physDCVector[4])
-        print("Setting RF...")
-        self.rfIf.setAtten(rfAtten)
-        print("Done")
+        writeDC = lambda: self.dcIf.transport.call_async(self.dcIf.setAllDacChannels, *physDCVector)
+        writeRF = lambda: self.rfIf.transport.call_async(self.rfIf.setAtten, rfAtten)
+        if order == 'parallel':
+            await asyncio.gather(writeDC(), writeRF())
+        elif order == 'dcFirst':
+            await writeDC()
+            await writeRF()
+        else:
+            await writeRF()
+            await writeDC()
         
-    def setTrapRaw(self, ecNear, ecFar):
-        physDCVector = dcMixer(self.traps['loading'][0:5])
+    async def setTrapRaw(self, ecNear, ecFar):
+        self._checkNoTransport()
+        physDCVector = list(self.physDCTraps['loading'])
         physDCVector[0] = ecNear
         physDCVector[1] = ecFar
-        self.dcIf.setAllDacChannels(physDCVector[0], physDCVector[1], physDCVector[2], physDCVector[3], physDCVector[4])
+        self.trapName = None
+        await self.dcIf.transport.call_async(self.dcIf.setAllDacChannels, *physDCVector)
+        
+    async def transportTrap(self, start, end, steps, stepInterval=1e-3, profile='cosine', wait=True, cache=True):
+        """Moves smoothly from one trap to another in 'steps' steps, 'stepInterval' seconds
+        apart.
+        
+        start and end are trap names or logical vectors [dcEcNear, dcEcFar, dopComp, sigComp,
+        vertComp] with an optional rfAtten. The RF attenuation is interpolated too if both ends
+        have one. profile is 'linear' or 'cosine' (which starts and stops gently).
+        
+        The waveform is streamed to the DACs in the background. If wait is False this returns
+        as soon as it has started; use waitTransport to wait for the end. With cache set, the
+        waveform is kept for the next transport with the same arguments (see
+        prerenderTransport), up to transportCacheSize waveforms. Setting a trap while a
+        transport is running raises RuntimeError."""
+        self._checkNoTransport()
+        dcWaveform, rfWaveform = self._transportWaveform(start, end, steps, profile, cache)
+        self.trapName = None
+        self.transportTask = asyncio.ensure_future(self._streamTransport(dcWaveform, rfWaveform, stepInterval,
+            end if isinstance(end, str) else None))
+        if wait:
+            await self.waitTransport()
+        
+    def _checkNoTransport(self):
+        """Raises RuntimeError if a transport is streaming, as any other write would be
+        interleaved with (and overwritten by) its steps"""
+        if self.transportTask is not None and not self.transportTask.done():
+            raise RuntimeError("A trap transport is already in progress")
+        
+    async def waitTransport(self):
+        """Waits for the running trap transport, if any, to finish"""
+        if self.transportTask is not None:
+            await asyncio.shield(self.transportTask)
+        
+    def prerenderTransport(self, start, end, steps, profile='cosine'):
+        """Computes and caches the waveform for a transport, so that transportTrap() with the same
+        arguments can start straight away"""
+        self._transportWaveform(start, end, steps, profile, True)
+        
+    def _transportWaveform(self, start, end, steps, profile, cache):
+        """Returns the physical DC vectors (one per row) and RF attenuations (or None) of each
+        step of a transport, excluding the starting point"""
+        import numpy as np
+        key = (self._cacheKey(start), self._cacheKey(end), steps, profile)
+        if key in self.transportCache:
+            self.transportCache.move_to_end(key)
+            return self.transportCache[key]
+        
+        if steps < 1:
+            raise ValueError("Trap transport needs at least one step")
+        startVector = self._trapVector(start)
+        endVector = self._trapVector(end)
+        if startVector.shape not in [(5,), (6,)] or endVector.shape not in [(5,), (6,)]:
+            raise ValueError("Trap vectors must have 5 DC entries and optionally an RF attenuation")
+        
+        t = np.arange(1, steps+1) / steps
+        if profile == 'cosine':
+            t = (1 - np.cos(np.pi*t)) / 2
+        elif profile != 'linear':
+            raise ValueError("Transport profile must be 'linear' or 'cosine'")
+        
+        dcWaveform = self.mixer.toPhysical(startVector[0:5] + np.outer(t, endVector[0:5] - startVector[0:5]))
+        if len(startVector) == 6 and len(endVector) == 6:
+            rfWaveform = startVector[5] + t*(endVector[5] - startVector[5])
+        else:
+            rfWaveform = None
+        
+        if cache:
+            self.transportCache[key] = (dcWaveform, rfWaveform)
+            while len(self.transportCache) > self.transportCacheSize:
+                self.transportCache.popitem(last=False)
+        return dcWaveform, rfWaveform
+        
+    def _trapVector(self, trap):
+        import numpy as np
+        if isinstance(trap, str):
+            if trap not in self.traps:
+                raise ValueError("Given trap name not in trap list")
+            trap = self.traps[trap]
+        return np.array(trap, dtype=float)
+        
+    def _cacheKey(self, trap):
+        return trap if isinstance(trap, str) else tuple(trap)
         
+    async def _streamTransport(self, dcWaveform, rfWaveform, stepInterval, endName):
+        loop = asyncio.get_event_loop()
+        nextStep = loop.time()
+        for i, physDCVector in enumerate(dcWaveform.tolist()):
+            if rfWaveform is None:
+                await self.dcIf.transport.call_async(self.dcIf.setAllDacChannels, *physDCVector)
+            else:
+                await self._writeTrap(physDCVector, rfWaveform[i])
+            if i == len(dcWaveform) - 1:
+                break
+            # Keep to the step rate, however long the writes took
+            nextStep += stepInterval
+            await asyncio.sleep(max(0, nextStep - loop.time()))
+        # Only a named trap if the RF was moved too
+        if rfWaveform is not None:
+            self.trapName = endName
+        
+    def toPhysical(self, logicalVectors):
+        """Maps a logical DC vector [dcEcNear, dcEcFar, dopComp, sigComp, vertComp], or a list
+        of them, to physical DAC voltages"""
+        return self.mixer.toPhysical(logicalVectors).tolist()
+        
+    def toLogical(self, physicalVectors):
+        """Inverse of toPhysical"""
+        return self.mixer.toLogical(physicalVectors).tolist()
+        
+    def getTraps(self):
+        """Returns the named traps as {name: [dcEcNear, dcEcFar, dopComp, sigComp, vertComp, rfAtten]}"""
+        return self.traps
         
     def ping(self):
         return True
@@ -45,8 +232,35 @@ class TrapDacSim:
     def __init__(self):
         pass
 
-    def setTrap(self, trapName):
+    def setTrap(self, trapName, order='parallel'):
         logger.warning("Going to trap '{}'".format(trapName))
+
+    def currentTrap(self):
+        return None
+
+    def currentVector(self):
+        return [None]*6
+
+    def invalidateCache(self):
+        pass
+
+    def toPhysical(self, logicalVectors):
+        return logicalVectors
+
+    def toLogical(self, physicalVectors):
+        return physicalVectors
+
+    def getTraps(self):
+        return TrapDac.traps
+
+    def transportTrap(self, start, end, steps, stepInterval=1e-3, profile='cosine', wait=True, cache=True):
+        logger.warning("Transporting from trap '{}' to '{}'".format(start, end))
+
+    def waitTransport(self):
+        pass
+
+    def prerenderTransport(self, start, end, steps, profile='cosine'):
+        pass
         
     def ping(self):
         return True
@@ -56,54 +270,96 @@ def dacChannelMapping(logicalChannel):
     
     return mapping(logicalChannel)
 
-# Maps a 'logical' vector of DC voltages to the 'physical' vector.
-def dcMixer(inputVector):
-    verticalCompensationVector = [0.000801256321392, -0.134061166991084, -0.017062918467318]
-    dopplerCompensationVector = [0.468819184381041, 1.711511132021197, 0.024809294762018]
-    sigmaCompensationVector = [-0.477674111263369, -1.743837680160108, 0.079653908484870]
-    outputVector = [0]*5
+# Logical to physical DC mixing matrix. The endcaps map straight through, and the three
+# compensation vectors (doppler, sigma, vertical) mix into physical channels 2, 4 and 3
+defaultMixerMatrix = [
+    [1.0, 0.0, 0.0, 0.0, 0.0],
+    [0.0, 1.0, 0.0, 0.0, 0.0],
+    [0.0, 0.0, 0.468819184381041, -0.477674111263369, 0.000801256321392],
+    [0.0, 0.0, 0.024809294762018, 0.079653908484870, -0.017062918467318],
+    [0.0, 0.0, 1.711511132021197, -1.743837680160108, -0.134061166991084]]
 
-    # Logical - physical mapping
-    mapping = [0, 1, 2, 4, 3]
 
-    # The two endcaps
-    outputVector[mapping[0]] = inputVector[0]
-    outputVector[mapping[1]] = inputVector[1]
+class DcMixer:
+    """Maps 'logical' vectors of DC voltages to 'physical' DAC vectors and back, through a
+    linear mixing matrix"""
+    def __init__(self, matrix=defaultMixerMatrix):
+        import numpy as np
+        self.matrix = np.array(matrix, dtype=float)
+        if self.matrix.shape != (5, 5):
+            raise ValueError("DC mixer matrix must be 5x5")
+        self.inverse = np.linalg.inv(self.matrix)
+    
+    def toPhysical(self, logicalVectors):
+        """Maps a logical vector, or an array with one logical vector per row, to physical"""
+        import numpy as np
+        return np.asarray(logicalVectors, dtype=float) @ self.matrix.T
     
-    outputVector[mapping[2]] = dopplerCompensationVector[0]*inputVector[2] + sigmaCompensationVector[0]*inputVector[3] + verticalCompensationVector[0]*inputVector[4]
-    outputVector[mapping[3]] = dopplerCompensationVector[1]*inputVector[2] + sigmaCompensationVector[1]*inputVector[3] + verticalCompensationVector[1]*inputVector[4]
-    outputVector[mapping[4]] = dopplerCompensationVector[2]*inputVector[2] + sigmaCompensationVector[2]*inputVector[3] + verticalCompensationVector[2]*inputVector[4]
-    print(outputVector)
-    return outputVector
+    def toLogical(self, physicalVectors):
+        """Maps a physical vector, or an array with one physical vector per row, to logical"""
+        import numpy as np
+        return np.asarray(physicalVectors, dtype=float) @ self.inverse.T
+
+
+# Maps a 'logical' vector of DC voltages to the 'physical' vector.
+def dcMixer(inputVector):
+    return DcMixer().toPhysical(inputVector).tolist()
 
 
 
 
 class OldlabDCInterface:
     def __init__(self, addr):
-        self.ser = serial.Serial(addr, baudrate=115200)
+        self.transport = SerialTransport(serial.Serial(addr, baudrate=115200))
+        # Last written values, rounded to the mV as sent. None until written
+        self.values = [None]*5
         time.sleep(1)
     
+    def invalidate(self):
+        """Forget the last written values, so that the next writes are sent"""
+        self.values = [None]*5
+    
     def setDacChannel(self, channel=0, value=0): # Sets a given DAC channel to a given value in Volts
         assert(channel>=0)
         assert(channel<5)
 
-        self.ser.write('v {} {:3.3f}\n'.format(channel,value).encode())
+        value = float('{:3.3f}'.format(value))
+        if self.values[channel] == value:
+            return
+        self.transport.write('v {} {:3.3f}\n'.format(channel,value))
+        self.values[channel] = value
 
     def setAllDacChannels(self, ch0=0, ch1=0, ch2=0, ch3=0, ch4=0): # Simultaneously set all DAC channels
-        self.ser.write('va {:3.3f} {:3.3f} {:3.3f} {:3.3f} {:3.3f}\n'.format(ch0, ch1, ch2, ch3, ch4).encode())
+        values = [float('{:3.3f}'.format(v)) for v in (ch0, ch1, ch2, ch3, ch4)]
+        if self.values == values:
+            return
+        self.transport.write('va {:3.3f} {:3.3f} {:3.3f} {:3.3f} {:3.3f}\n'.format(*values))
+        self.values = values
     
 
 class OldlabRFAttenuatorInterface:
     def __init__(self, addr):
-        self.ser = serial.Serial(addr, baudrate=115200)
+        self.transport = SerialTransport(serial.Serial(addr, baudrate=115200))
+        # Last written attenuation in hardware units, None until written
+        self.attenLSB = None
         #time.sleep(1)
     
+    def invalidate(self):
+        """Forget the last written attenuation, so that the next write is sent"""
+        self.attenLSB = None
+    
     def setAtten(self, value=0):
         atten = math.floor( value*2 + 0.5)/2.0
         atten = min(atten,31.5)
         atten = max(atten,0)
         attenLSB = int(atten/0.5) # Attenutation value in hardware units of 0.5dB
-        self.ser.write('atten {}\n'.format(attenLSB).encode())
+        if attenLSB == self.attenLSB:
+            return
+        self.transport.write('atten {}\n'.format(attenLSB))
+        self.attenLSB = attenLSB
+
+    def getAtten(self):
+        """Returns the last written attenuation in dB, or None"""
+        return None if self.attenLSB is None else self.attenLSB*0.5
     
     
\ No newline at end of file
@@ -1,8 +1,9 @@
 # Test trapDac
 from driver import *
+import asyncio
 
 dev = TrapDac('/dev/arduino_64935343233351B07032', '/dev/arduino_6493534353335160C011')
 
 
-#dev.setTrap('loading')
-dev.setTrap('tight')
\ No newline at end of file
+#asyncio.get_event_loop().run_until_complete(dev.setTrap('loading'))
+asyncio.get_event_loop().run_until_complete(dev.setTrap('tight'))
\ No newline at end of file
@@ -5,6 +5,8 @@ import sys
 import asyncio
 from enum import Enum
 
+from artiqDrivers.serialTransport import SerialTransport, transaction
+
 logger = logging.getLogger(__name__)
 
 PsuType = Enum("PsuType", ["QL355P", "QL355TP"])
@@ -20,14 +22,18 @@ class QL355:
 
     All voltages are in Volts, and currents in Amps."""
     def __init__(self, serial_addr):
-        self.port = serial.Serial(
-            serial_addr,
-            baudrate=19200,
-            timeout=0.1,
-            write_timeout=0.1)
+        self.transport = SerialTransport(
+            serial.Serial(
+                serial_addr,
+                baudrate=19200,
+                write_timeout=0.1),
+            terminator=b'\r',
+            timeout=0.1)
+        # Writes may happen on the transport's worker thread, so keep hold of the loop
+        self.loop = asyncio.get_event_loop()
         self._purge()
 
-        ident = self.identity()
+        ident = self._identity()
         if ident.startswith("THURLBY-THANDAR,QL355P"):
             self.type = PsuType.QL355P
         elif ident.startswith("THURLBY-THANDAR,QL355TP"):
@@ -39,34 +45,26 @@ class QL355:
     def _purge(self):
         """Make sure we start from a clean slate with the controller"""
         # Send a carriage return to clear the controller's input buffer
-        self.port.write('\r'.encode())
+        self.transport.write('\r')
         # Read any old gibberish from input until a timeout occurs
-        c = 'c'
-        while c != '':
-            c = self.port.read().decode()
+        self.transport.drain()
 
     def close(self):
         """Close the serial port."""
-        self.port.close()
+        self.transport.close()
 
     def _send_command(self, cmd):
         try:
-            self.port.write((cmd+'\r\n').encode())
+            self.transport.write(cmd+'\r\n')
         except serial.SerialTimeoutException as e:
             logger.exception("Serial write timeout: Force exit")
             # This is hacky but makes the server exit
-            asyncio.get_event_loop().call_soon(sys.exit, 42)
+            self.loop.call_soon_threadsafe(sys.exit, 42)
             raise
 
     def _read_line(self):
         """Read a CR terminated line. Returns '' on timeout"""
-        s = ''
-        while len(s) == 0 or s[-1] != '\r':
-            c = self.port.read().decode()
-            if c == '': # Timeout
-                break
-            s += c
-        return s
+        return self.transport.read_line()
 
     def _check_valid_channel(self, channel, is_enable=False):
         """Raises a ValueError if the channel number is not valid for this PSU type. 
@@ -79,6 +77,7 @@ class QL355:
             if channel < 0 or ( ( channel > 1 and not is_enable) or channel>2 ):
                 raise ex
 
+    @transaction
     def set_voltage_limit(self, voltage, channel=0):
         """Sets the voltage limit for channel"""
         self._check_valid_channel(channel)
@@ -86,19 +85,14 @@ class QL355:
             raise ValueError("Voltage limit must be positive")
         self._send_command("V{} {}".format(channel+1, voltage))
 
+    @transaction
     def get_voltage_limit(self, channel=0):
         """Returns the voltage limit for channel"""
         self._check_valid_channel(channel)
         self._send_command("V{}?".format(channel+1))
-        response = self._read_line().split()
-        if response[0] != "V{}".format(channel+1):
-            raise Exception("Device responded incorrectly")
-        try:
-            val = float(response[1])
-        except ValueError:
-            raise ValueError("Could not interpret device response as a float")
-        return val
+        return self._parse_setting(self._read_line(), "V{}".format(channel+1))
 
+    @transaction
     def set_current_limit(self, current, channel=0):
         """Sets the current limit for channel"""
         self._check_valid_channel(channel)
@@ -106,52 +100,100 @@ class QL355:
             raise ValueError("Current limit must be positive")
         self._send_command("I{} {}".format(channel+1, current))
 
+    @transaction
     def get_current_limit(self, channel=0):
         """Returns the current limit for channel"""
         self._check_valid_channel(channel)
         self._send_command("I{}?".format(channel+1))
-        response = self._read_line().split()
-        if response[0] != "I{}".format(channel+1):
-            raise Exception("Device responded incorrectly")
-        try:
-            val = float(response[1])
-        except ValueError:
-            raise ValueError("Could not interpret device response as a float")
-        return val
+        return self._parse_setting(self._read_line(), "I{}".format(channel+1))
 
+    @transaction
     def set_output_enable(self, enable, channel=0):
         """Enable / disable a channel"""
         self._check_valid_channel(channel, is_enable=True)
         # enable flag needs to be 0 or 1, hence int(bool) dance
         self._send_command("OP{} {}".format(channel+1, int(bool(enable))))
 
+    @transaction
     def get_voltage(self, channel=0):
         """Returns the actual output voltage"""
         self._check_valid_channel(channel)
         self._send_command("V{}O?".format(channel+1))
-        response = self._read_line().strip()
-        try:
-            val = float(response[0:-1])
-        except ValueError:
-            raise ValueError("Could not interpret device response as a float")
-        return val
+        return self._parse_reading(self._read_line())
 
+    @transaction
     def get_current(self, channel=0):
         """Returns the actual output current"""
         self._check_valid_channel(channel)
         self._send_command("I{}O?".format(channel+1))
-        response = self._read_line().strip()
+        return self._parse_reading(self._read_line())
+
+    @transaction
+    def get_status(self, channels=None):
+        """Returns a snapshot of the voltage and current limits and actual
+        outputs of the given channels (default: all channels with settable
+        outputs), as {channel: {'voltage_limit': .., 'current_limit': ..,
+        'voltage': .., 'current': ..}}.
+
+        All queries go out in one line and the replies are read back together,
+        which is much faster than calling the individual getters."""
+        if channels is None:
+            channels = [0] if self.type is PsuType.QL355P else [0, 1]
+        for channel in channels:
+            self._check_valid_channel(channel)
+
+        queries = []
+        for channel in channels:
+            queries += ["V{}?".format(channel+1), "I{}?".format(channel+1),
+                        "V{}O?".format(channel+1), "I{}O?".format(channel+1)]
+        self._send_command(";".join(queries))
+
+        # Replies may arrive one per line or ';' separated
+        replies = []
+        while len(replies) < len(queries):
+            line = self._read_line()
+            if line == '':
+                raise IOError("Timeout while reading status, got {}".format(replies))
+            replies += [r for r in line.strip().split(";") if r.strip()]
+
+        status = {}
+        for n, channel in enumerate(channels):
+            vLimit, iLimit, voltage, current = replies[4*n:4*n+4]
+            status[channel] = {
+                'voltage_limit': self._parse_setting(vLimit, "V{}".format(channel+1)),
+                'current_limit': self._parse_setting(iLimit, "I{}".format(channel+1)),
+                'voltage': self._parse_reading(voltage),
+                'current': self._parse_reading(current)}
+        return status
+
+    def _parse_setting(self, response, header):
+        """Parses a '<header> <value>' reply to a setting query"""
+        response = response.split()
+        if len(response) != 2 or response[0] != header:
+            raise Exception("Device responded incorrectly")
         try:
-            val = float(response[0:-1])
+            return float(response[1])
         except ValueError:
             raise ValueError("Could not interpret device response as a float")
-        return val
 
+    def _parse_reading(self, response):
+        """Parses a '<value><unit>' reply to an output readback query"""
+        response = response.strip()
+        try:
+            return float(response[0:-1])
+        except ValueError:
+            raise ValueError("Could not interpret device response as a float")
+
+    @transaction
     def identity(self):
         """Returns the identity string of the device"""
+        return self._identity()
+
+    def _identity(self):
         self._send_command("*IDN?")
         return self._read_line()
 
+    @transaction
     def ping(self):
-        self.identity()
+        self._identity()
         return True
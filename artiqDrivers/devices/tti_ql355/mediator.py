@@ -1,7 +1,3 @@
-from artiq.language.core import *
-import numpy as np
-import time
-
 class PsuWrapper:
     """
     Wraps multiple power supplies to allow reference to channels by an
@@ -0,0 +1,254 @@
+"""Protocol-level stand-ins for the instruments, for exercising the drivers without hardware.
+
+Serial instruments are emulated on a pseudo-terminal, so a driver opens FakeDevice.addr just as
+it would open the real serial port. The Rohde & Schwarz synth is emulated by a local TCP server.
+All fakes reply after a configurable latency, and log the commands they receive."""
+import os
+import socket
+import threading
+import time
+import tty
+
+
+class FakeSerialDevice:
+    """Base class for instruments emulated on a pseudo-terminal.
+
+    Subclasses implement handle(command), which is called for every terminator-delimited
+    command received (stripped of whitespace) and returns the reply as a str, or None for
+    no reply."""
+    terminator = b'\n'
+
+    def __init__(self, latency=0.0):
+        """latency : time in seconds between receiving a command and replying"""
+        self.latency = latency
+        self.commands = []
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.addr = os.ttyname(self._slave)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self):
+        buf = b''
+        while True:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += data
+            *lines, buf = buf.split(self.terminator)
+            for line in lines:
+                command = line.decode().strip()
+                if not command:
+                    continue
+                self.commands.append(command)
+                reply = self.handle(command)
+                if reply is not None:
+                    if self.latency:
+                        time.sleep(self.latency)
+                    os.write(self._master, reply.encode())
+
+    def handle(self, command):
+        raise NotImplementedError
+
+
+class FakeCoherentDds(FakeSerialDevice):
+    def __init__(self, latency=0.0):
+        self.profiles = {}
+        self.pulseShapes = {}
+        self._shapeChannel = None
+        super().__init__(latency)
+
+    def handle(self, command):
+        if self._shapeChannel is not None:
+            # Second line of a setPulseShape command
+            self.pulseShapes[self._shapeChannel] = [int(x) for x in command.split(',')]
+            self._shapeChannel = None
+            return None
+        args = command.split()
+        if args[0] == 'idn?':
+            return 'CoherentDDS fake\n'
+        elif args[0] == 'setProfile':
+            channel, profile, freq, phase, amp = map(int, args[1:])
+            self.profiles[(channel, profile)] = (freq, phase, amp)
+        elif args[0] == 'setPulseShape':
+            self._shapeChannel = int(args[1])
+        elif args[0] == 'reset':
+            self.profiles = {}
+        return None
+
+
+class FakeArduinoDds(FakeSerialDevice):
+    def __init__(self, latency=0.0, acknowledged=False):
+        """acknowledged : reply to every PLSB command, as newer firmware does"""
+        self.acknowledged = acknowledged
+        self.profiles = {}
+        super().__init__(latency)
+
+    def handle(self, command):
+        args = command.split()
+        if args[0] == '*IDN?':
+            return 'ArduinoDDS fake\n'
+        elif args[0] == 'PLSB':
+            profile, amp, phase, freq = map(int, args[1:])
+            self.profiles[profile] = (freq, phase, amp)
+            if self.acknowledged:
+                return 'OK\n'
+        elif args[0] == 'reset':
+            self.profiles = {}
+        return None
+
+
+class FakeDosDac(FakeSerialDevice):
+    def __init__(self, latency=0.0):
+        self.values = [0]*11
+        super().__init__(latency)
+
+    def handle(self, command):
+        args = command.split()
+        if args[0] == 'S':
+            self.values[int(args[1])] = int(args[2])
+        elif args[0] == 'G':
+            return '{}\n'.format(self.values[int(args[1])])
+        return None
+
+
+class FakeOldlabDC(FakeSerialDevice):
+    def __init__(self, latency=0.0):
+        self.values = [0.0]*5
+        super().__init__(latency)
+
+    def handle(self, command):
+        args = command.split()
+        if args[0] == 'v':
+            self.values[int(args[1])] = float(args[2])
+        elif args[0] == 'va':
+            self.values = [float(x) for x in args[1:]]
+        return None
+
+
+class FakeOldlabRFAttenuator(FakeSerialDevice):
+    def __init__(self, latency=0.0):
+        self.attenLSB = 0
+        super().__init__(latency)
+
+    def handle(self, command):
+        args = command.split()
+        if args[0] == 'atten':
+            self.attenLSB = int(args[1])
+        return None
+
+
+class FakeQL355(FakeSerialDevice):
+    """TTI QL355P / QL355TP. Several commands may be sent on one line separated by ';'"""
+    def __init__(self, latency=0.0, twoChannel=True):
+        self.model = 'QL355TP' if twoChannel else 'QL355P'
+        self.voltageLimits = [0.0, 0.0]
+        self.currentLimits = [0.0, 0.0]
+        self.outputs = [False, False, False]
+        super().__init__(latency)
+
+    def handle(self, command):
+        replies = [self._handleOne(c.strip()) for c in command.split(';')]
+        replies = [r for r in replies if r is not None]
+        return ''.join(replies) if replies else None
+
+    def _handleOne(self, command):
+        if command == '*IDN?':
+            return 'THURLBY-THANDAR,{},0,1.00\r\n'.format(self.model)
+        args = command.split()
+        header = args[0]
+        if header.startswith('OP'):
+            self.outputs[int(header[2])-1] = bool(int(args[1]))
+            return None
+        kind, ch = header[0], int(header[1])-1
+        limits = self.voltageLimits if kind == 'V' else self.currentLimits
+        if header.endswith('O?'):
+            # Output readback: assume the output sits at the voltage limit and draws no current
+            value = limits[ch] if kind == 'V' and self.outputs[ch] else 0.0
+            return '{:.3f}{}\r\n'.format(value, 'V' if kind == 'V' else 'A')
+        elif header.endswith('?'):
+            return '{}{} {:.3f}\r\n'.format(kind, ch+1, limits[ch])
+        else:
+            limits[ch] = float(args[1])
+            return None
+
+
+class FakeMDT69xB(FakeSerialDevice):
+    """Thorlabs MDT693B piezo controller with echo off. Replies follow responses.txt in
+    artiqDrivers/devices/thorlabs_mdt69xb"""
+    terminator = b'\r'
+
+    def __init__(self, latency=0.0, serial='000000-00', vLimit=150):
+        self.serial = serial
+        self.vLimit = vLimit
+        self.voltages = {'x': 0.0, 'y': 0.0, 'z': 0.0}
+        super().__init__(latency)
+
+    def handle(self, command):
+        command = command.lower()
+        if command.startswith('echo'):
+            return '*[Echo Off]\r'
+        elif command == 'vlimit?':
+            return '*[ {}]\r'.format(self.vLimit)
+        elif command == 'id?':
+            return ('*\r\r\rModel MDT693B Piezo Control Module\rFirmware Version: 1.05\r'
+                    'Voltage Range: 0V to {}V\rSerial#:{}\rFriendly Name:MDT693B\r'
+                    'Thorlabs, Inc. Newton, NJ 07860\rwww.thorlabs.com\r\r').format(self.vLimit, self.serial)
+        elif command[1:] == 'voltage?':
+            return '*[{:6.1f}]\r'.format(self.voltages[command[0]])
+        elif command[1:].startswith('voltage='):
+            self.voltages[command[0]] = float(command.split('=')[1])
+        return '*'
+
+
+class FakeRohdeSynth:
+    """Rohde & Schwarz SMA100A SCPI server on localhost. Connect to (addr, port)"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.commands = []
+        self.settings = {'FREQ': '1000000000', 'POW': '-30', 'OUTP': '0', 'FREQ:MODE': 'CW',
+                         '*IDN': 'Rohde&Schwarz,SMA100A,fake,1.0', '*OPC': '1'}
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self.addr, self.port = self._server.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn, conn.makefile('rb') as f:
+            for line in f:
+                replies = []
+                for command in line.decode().strip().split(';'):
+                    command = command.strip().lstrip(':')
+                    if not command:
+                        continue
+                    self.commands.append(command)
+                    header, _, value = command.partition(' ')
+                    if header.endswith('?'):
+                        replies.append(self.settings.get(header[:-1], '0'))
+                    elif header == 'OUTP':
+                        self.settings[header] = '1' if value in ('ON', '1') else '0'
+                    else:
+                        self.settings[header] = value
+                if replies:
+                    if self.latency:
+                        time.sleep(self.latency)
+                    conn.sendall((';'.join(replies) + '\n').encode())
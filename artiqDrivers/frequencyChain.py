@@ -0,0 +1,64 @@
+class ChainStage:
+    """One DDS channel and the frequency chain after it.
+
+    The logical frequency produced by the chain is
+        offset + multiplier * order * passes * ddsFrequency
+    where offset is the frequency added by the rest of the chain (a local oscillator, other
+    AOMs, ...), multiplier is any frequency multiplication after the DDS, order is the AOM
+    diffraction order (negative for a down-shift) and passes the number of passes through it."""
+    def __init__(self, dds=None, offset=0.0, multiplier=1, order=1, passes=1, range=None):
+        """dds : DDS channel number, None for single channel DDSs
+        range : optional [min, max] of allowed DDS frequencies in Hz"""
+        gain = multiplier * order * passes
+        if gain == 0:
+            raise ValueError("Frequency chain multiplier, order and passes must be non-zero")
+        self.dds = dds
+        self.range = range
+        # Compiled to ddsFrequency = scale*logicalFrequency + shift
+        self.scale = 1.0 / gain
+        self.shift = -offset / gain
+        # A phase shift of the DDS output is multiplied along the chain too. The sign of the
+        # diffraction order is not applied
+        self.phaseScale = 1.0 / abs(gain)
+
+
+class FrequencyChain:
+    """Converts between logical frequencies and the frequencies of the DDS channels that
+    produce them, for a set of named channels.
+
+    channels is a dictionary of {name: stage description}, where each description is a
+    dictionary of ChainStage arguments. This can be given directly in the device database,
+    e.g.
+        {"rV": {"dds": 1, "offset": -109e6, "order": -1, "range": [105e6, 113e6]}}
+    All conversions work on single numbers as well as on arrays."""
+    def __init__(self, channels):
+        self.stages = {name: ChainStage(**desc) for name, desc in channels.items()}
+
+    def _stage(self, channel):
+        try:
+            return self.stages[channel]
+        except KeyError:
+            raise ValueError("Channel must be one of {}".format(sorted(self.stages)))
+
+    def toPhysical(self, channel, freqs):
+        """Returns (DDS channel, DDS frequencies, phase scale) for logical frequencies. Phases
+        are to be multiplied by the phase scale. Raises ValueError if any DDS frequency is
+        outside the range of the channel"""
+        import numpy as np
+        stage = self._stage(channel)
+        freqsDDS = stage.scale*np.asarray(freqs, dtype=float) + stage.shift
+        if stage.range is not None:
+            outOfRange = (freqsDDS < stage.range[0]) | (freqsDDS > stage.range[1])
+            if outOfRange.any():
+                raise ValueError("{} frequency out of range, {:.0f}MHz not in [{:.0f},{:.0f}]MHz".format(
+                    channel, freqsDDS[outOfRange][0]/1e6, stage.range[0]/1e6, stage.range[1]/1e6))
+        return stage.dds, freqsDDS, stage.phaseScale
+
+    def toLogical(self, channel, freqsDDS):
+        """Returns the logical frequencies produced by DDS frequencies"""
+        import numpy as np
+        stage = self._stage(channel)
+        return (np.asarray(freqsDDS, dtype=float) - stage.shift) / stage.scale
+
+    def channels(self):
+        return list(self.stages)
@@ -4,11 +4,13 @@ import argparse
 import sys
 
 from artiqDrivers.devices.arduinoDds.driver import ArduinoDds, ArduinoDdsSim
-from artiq.protocols.pc_rpc import simple_server_loop
-from artiq.tools import verbosity_args, simple_network_args, init_logger
+from artiqDrivers.frontend.server import parallel_server_loop
+from artiqDrivers.instrumentation import instrument
 
 
 def get_argparser():
+    from artiq.tools import verbosity_args, simple_network_args
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--device", default=None,
                         help="serial device. See documentation for how to "
@@ -17,13 +19,21 @@ def get_argparser():
                         help="Put the driver in simulation mode, even if "
                              "--device is used.")
     parser.add_argument("--clockfreq", default=1e9, type=float, help="clock frequency provided to DDS")
+    parser.add_argument("--ack", action="store_true",
+                        help="firmware acknowledges every profile write, so "
+                             "don't wait a fixed time after each one")
     
     simple_network_args(parser, 4003)
+    parser.add_argument("--stats", action="store_true",
+                        help="record per-method and per-command latency "
+                             "statistics, readable with get_stats()")
     verbosity_args(parser)
     return parser
 
 
 def main():
+    from artiq.tools import init_logger
+
     args = get_argparser().parse_args()
     init_logger(args)
 
@@ -35,9 +45,11 @@ def main():
     if args.simulation:
         dev = ArduinoDdsSim()
     else:
-        dev = ArduinoDds(addr=args.device, clockFreq=args.clockfreq)
+        dev = ArduinoDds(addr=args.device, clockFreq=args.clockfreq, acknowledged=args.ack)
+    if args.stats:
+        instrument(dev)
         
-    simple_server_loop({"arduinoDds": dev}, args.bind, args.port)
+    parallel_server_loop({"arduinoDds": dev}, args.bind, args.port)
 
 
 if __name__ == "__main__":
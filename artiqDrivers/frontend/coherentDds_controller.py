@@ -4,11 +4,13 @@ import argparse
 import sys
 
 from artiqDrivers.devices.coherentDds.driver import CoherentDds, CoherentDdsSim
-from artiq.protocols.pc_rpc import simple_server_loop
-from artiq.tools import verbosity_args, simple_network_args, init_logger
+from artiqDrivers.frontend.server import parallel_server_loop
+from artiqDrivers.instrumentation import instrument
 
 
 def get_argparser():
+    from artiq.tools import verbosity_args, simple_network_args
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--device", default=None,
                         help="serial device. See documentation for how to "
@@ -19,11 +21,16 @@ def get_argparser():
     parser.add_argument("--clockfreq", default=1e9, type=float, help="clock frequency provided to DDS")
     
     simple_network_args(parser, 4000)
+    parser.add_argument("--stats", action="store_true",
+                        help="record per-method and per-command latency "
+                             "statistics, readable with get_stats()")
     verbosity_args(parser)
     return parser
 
 
 def main():
+    from artiq.tools import init_logger
+
     args = get_argparser().parse_args()
     init_logger(args)
 
@@ -36,8 +43,10 @@ def main():
         dev = CoherentDdsSim()
     else:
         dev = CoherentDds(addr=args.device, clockFreq=args.clockfreq)
+    if args.stats:
+        instrument(dev)
         
-    simple_server_loop({"coherentDds": dev}, args.bind, args.port)
+    parallel_server_loop({"coherentDds": dev}, args.bind, args.port)
 
 
 if __name__ == "__main__":
@@ -4,11 +4,13 @@ import argparse
 import sys
 
 from artiqDrivers.devices.dosDac.driver import DosDac, DosDacSim
-from artiq.protocols.pc_rpc import simple_server_loop
-from artiq.tools import verbosity_args, simple_network_args, init_logger
+from artiqDrivers.frontend.server import parallel_server_loop
+from artiqDrivers.instrumentation import instrument
 
 
 def get_argparser():
+    from artiq.tools import verbosity_args, simple_network_args
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--device", default=None,
                         help="serial device. See documentation for how to "
@@ -17,12 +19,20 @@ def get_argparser():
                         help="Put the driver in simulation mode, even if "
                              "--device is used.")
     
+    parser.add_argument("--timeout", default=1.0, type=float,
+                        help="time in seconds to wait for the DAC to answer "
+                             "before giving up")
     simple_network_args(parser, 4001)
+    parser.add_argument("--stats", action="store_true",
+                        help="record per-method and per-command latency "
+                             "statistics, readable with get_stats()")
     verbosity_args(parser)
     return parser
 
 
 def main():
+    from artiq.tools import init_logger
+
     args = get_argparser().parse_args()
     init_logger(args)
 
@@ -34,9 +44,11 @@ def main():
     if args.simulation:
         dev = DosDacSim()
     else:
-        dev = DosDac(addr=args.device)
+        dev = DosDac(addr=args.device, timeout=args.timeout)
+    if args.stats:
+        instrument(dev)
         
-    simple_server_loop({"dosDac": dev}, args.bind, args.port)
+    parallel_server_loop({"dosDac": dev}, args.bind, args.port)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3.5
+"""Serves several devices from one controller process and port.
+
+The devices are listed in a pyon config file, in the style of an ARTIQ device database:
+
+    {
+        "coherentDds": {
+            "module": "artiqDrivers.devices.coherentDds.driver",
+            "class": "CoherentDds",
+            "arguments": {"addr": "/dev/ttyUSB0", "clockFreq": 1e9}
+        },
+        "piezoController": {
+            "module": "artiqDrivers.devices.thorlabs_mdt69xb.driver",
+            "class": "PiezoController",
+            "arguments": {"serial_addr": "/dev/ttyUSB1"}
+        }
+    }
+
+Each key becomes an RPC target name. The devices are opened concurrently, so startup takes
+about as long as the slowest device.
+
+Drivers without any coroutine methods (e.g. RohdeSynth) do their I/O in blocking calls, so
+all their methods are run on a worker thread of their own. A slow or unresponsive device then
+doesn't hold up calls to the others."""
+
+import argparse
+import asyncio
+import functools
+import importlib
+import inspect
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from artiqDrivers.frontend.server import parallel_server_loop
+from artiqDrivers.instrumentation import instrument
+
+logger = logging.getLogger(__name__)
+
+
+def get_argparser():
+    from artiq.tools import verbosity_args, simple_network_args
+
+    parser = argparse.ArgumentParser(description="ARTIQ controller serving several devices")
+    parser.add_argument("config",
+                        help="pyon file listing the devices to serve")
+    simple_network_args(parser, 4010)
+    parser.add_argument("--stats", action="store_true",
+                        help="record per-method and per-command latency "
+                             "statistics, readable with get_stats()")
+    verbosity_args(parser)
+    return parser
+
+
+def _create(loop, name, cls, arguments):
+    # Some drivers keep hold of the event loop, which isn't set for this thread
+    asyncio.set_event_loop(loop)
+    logger.info("Opening '{}'".format(name))
+    dev = cls(**arguments)
+    logger.info("Opened '{}'".format(name))
+    return dev
+
+
+def close_devices(devices):
+    for name, dev in devices.items():
+        try:
+            if hasattr(dev, "close"):
+                dev.close()
+        except Exception:
+            logger.exception("Failed to close '{}'".format(name))
+
+
+def save_devices(devices):
+    """Save the state of devices that keep it between runs (e.g. piezo setpoints)"""
+    for name, dev in devices.items():
+        try:
+            if hasattr(dev, "save_setpoints"):
+                dev.save_setpoints()
+        except Exception:
+            logger.exception("Failed to save '{}'".format(name))
+
+
+def _public_methods(dev):
+    # Not just inspect.ismethod, as instrument() replaces methods with plain functions
+    return [(name, method) for name, method in inspect.getmembers(dev, inspect.isroutine)
+            if not name.startswith("_")]
+
+
+def _offloaded(executor, name, method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        fn = getattr(self._device, name)
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+    return wrapper
+
+
+def rpc_target(dev):
+    """Returns (target, executor): the object to serve for a driver, and the executor it runs
+    on or None. A driver with coroutine methods is served as it is. For a driver without any,
+    the target is a stand-in whose methods are coroutines running the driver's methods one at
+    a time on a worker thread"""
+    methods = _public_methods(dev)
+    if any(inspect.iscoroutinefunction(method) for _, method in methods):
+        return dev, None
+    executor = ThreadPoolExecutor(max_workers=1)
+    namespace = {name: _offloaded(executor, name, method) for name, method in methods}
+    namespace["__doc__"] = type(dev).__doc__
+    target = type(type(dev).__name__, (), namespace)()
+    target._device = dev
+    return target, executor
+
+
+def create_devices(config, loop):
+    """Instantiate the devices in a config dictionary, all at once. Returns a dictionary of
+    devices keyed by name. If any device fails to open, the others are closed and the first
+    exception is raised"""
+    # Import in this thread, as imports in parallel gain nothing
+    classes = {name: getattr(importlib.import_module(desc["module"]), desc["class"])
+               for name, desc in config.items()}
+    with ThreadPoolExecutor(max_workers=max(1, len(config))) as executor:
+        futures = {name: executor.submit(_create, loop, name, classes[name],
+                                         config[name].get("arguments", {}))
+                   for name in config}
+    devices = {}
+    error = None
+    for name, future in futures.items():
+        try:
+            devices[name] = future.result()
+        except Exception as e:
+            logger.error("Failed to open '{}'".format(name), exc_info=True)
+            if error is None:
+                error = e
+    if error is not None:
+        close_devices(devices)
+        save_devices(devices)
+        raise error
+    return devices
+
+
+def main():
+    import artiq.protocols.pyon as pyon
+    from artiq.tools import init_logger
+
+    args = get_argparser().parse_args()
+    init_logger(args)
+
+    config = pyon.load_file(args.config)
+    loop = asyncio.get_event_loop()
+    try:
+        devices = create_devices(config, loop)
+    except Exception:
+        sys.exit(1)
+    if args.stats:
+        for dev in devices.values():
+            instrument(dev)
+    targets = {}
+    executors = []
+    for name, dev in devices.items():
+        targets[name], executor = rpc_target(dev)
+        if executor is not None:
+            executors.append(executor)
+
+    # Q: Why not use try/finally for port closure?
+    # A: We don't want to try to close the serial if sys.exit() is called,
+    #    and sys.exit() isn't caught by Exception
+    try:
+        parallel_server_loop(targets, args.bind, args.port)
+    except Exception:
+        close_devices(devices)
+    else:
+        close_devices(devices)
+    finally:
+        save_devices(devices)
+        for executor in executors:
+            executor.shutdown(wait=False)
+
+if __name__ == "__main__":
+    main()
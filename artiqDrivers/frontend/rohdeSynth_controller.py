@@ -3,12 +3,13 @@
 import argparse
 import sys
 
-from artiqDrivers.devices.rohdeSynth.driver import RohdeSynth
-from artiq.protocols.pc_rpc import simple_server_loop
-from artiq.tools import verbosity_args, simple_network_args, init_logger
+from artiqDrivers.devices.rohdeSynth.driver import RohdeSynth, RohdeSynthSim
+from artiqDrivers.instrumentation import instrument
 
 
 def get_argparser():
+    from artiq.tools import verbosity_args, simple_network_args
+
     parser = argparse.ArgumentParser(description="ARTIQ controller for the Rohde&Schwarz SMA100A synthesiser")
     parser.add_argument("-i", "--ipaddr", default=None,
                         help="IP address of synth")
@@ -17,11 +18,17 @@ def get_argparser():
                              "--ipaddress is used.")
 
     simple_network_args(parser, 4004)
+    parser.add_argument("--stats", action="store_true",
+                        help="record per-method and per-command latency "
+                             "statistics, readable with get_stats()")
     verbosity_args(parser)
     return parser
 
 
 def main():
+    from artiq.protocols.pc_rpc import simple_server_loop
+    from artiq.tools import init_logger
+
     args = get_argparser().parse_args()
     init_logger(args)
 
@@ -34,6 +41,8 @@ def main():
         dev = RohdeSynthSim()
     else:
         dev = RohdeSynth(addr=args.ipaddr)
+    if args.stats:
+        instrument(dev)
 
     try:
         simple_server_loop({"rohdeSynth": dev}, args.bind, args.port)
@@ -0,0 +1,19 @@
+import asyncio
+
+
+def parallel_server_loop(targets, host, port, description=None):
+    """Like artiq.protocols.pc_rpc.simple_server_loop, but lets RPC calls from different
+    clients run concurrently. While a coroutine driver method is waiting for its device,
+    other clients are still served."""
+    from artiq.protocols.pc_rpc import Server
+
+    loop = asyncio.get_event_loop()
+    try:
+        server = Server(targets, description, True, allow_parallel=True)
+        loop.run_until_complete(server.start(host, port))
+        try:
+            loop.run_until_complete(server.wait_terminate())
+        finally:
+            loop.run_until_complete(server.stop())
+    finally:
+        loop.close()
@@ -4,10 +4,12 @@ import argparse
 import sys
 
 from artiqDrivers.devices.thorlabs_mdt69xb.driver import PiezoController
-from artiq.protocols.pc_rpc import simple_server_loop
-from artiq.tools import verbosity_args, simple_network_args, init_logger
+from artiqDrivers.frontend.server import parallel_server_loop
+from artiqDrivers.instrumentation import instrument
 
 def get_argparser():
+    from artiq.tools import verbosity_args, simple_network_args
+
     parser = argparse.ArgumentParser(description="ARTIQ controller for the Thorlabs MDT693B or MDT694B 3 (1) channel open-loop piezo controller")
     simple_network_args(parser, 4002)
     parser.add_argument("-d", "--device", default=None,
@@ -16,11 +18,16 @@ def get_argparser():
     parser.add_argument("--simulation", action="store_true",
                         help="Put the driver in simulation mode, even if "
                              "--device is used.")
+    parser.add_argument("--stats", action="store_true",
+                        help="record per-method and per-command latency "
+                             "statistics, readable with get_stats()")
     verbosity_args(parser)
     return parser
 
 
 def main():
+    from artiq.tools import init_logger
+
     args = get_argparser().parse_args()
     init_logger(args)
 
@@ -30,12 +37,14 @@ def main():
         sys.exit(1)
 
     dev = PiezoController(args.device if not args.simulation else None)
+    if args.stats:
+        instrument(dev)
 
     # Q: Why not use try/finally for port closure?
     # A: We don't want to try to close the serial if sys.exit() is called,
     #    and sys.exit() isn't caught by Exception
     try:
-        simple_server_loop({"piezoController": dev}, args.bind, args.port)
+        parallel_server_loop({"piezoController": dev}, args.bind, args.port)
     except Exception:
         dev.close()
     else:
@@ -4,26 +4,35 @@ import argparse
 import sys
 
 from artiqDrivers.devices.trapDac.driver import TrapDac, TrapDacSim
-from artiq.protocols.pc_rpc import simple_server_loop
-from artiq.tools import verbosity_args, simple_network_args, init_logger
+from artiqDrivers.frontend.server import parallel_server_loop
+from artiqDrivers.instrumentation import instrument
 
 
 def get_argparser():
+    from artiq.tools import verbosity_args, simple_network_args
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--trapDacDevice", default=None,
                         help="Trap DC Dac serial device")
     parser.add_argument("--trapRFDevice", default=None,
                         help="Trap RF serial device")    
+    parser.add_argument("--config", default=None,
+                        help="pyon file with the DC mixer matrix and named traps")
     parser.add_argument("--simulation", action="store_true",
                         help="Put the driver in simulation mode, even if "
                              "--device is used.")
     
     simple_network_args(parser, 4005)
+    parser.add_argument("--stats", action="store_true",
+                        help="record per-method and per-command latency "
+                             "statistics, readable with get_stats()")
     verbosity_args(parser)
     return parser
 
 
 def main():
+    from artiq.tools import init_logger
+
     args = get_argparser().parse_args()
     init_logger(args)
 
@@ -35,9 +44,11 @@ def main():
     if args.simulation:
         dev = TrapDacSim()
     else:
-        dev = TrapDac(addrDCInterface=args.trapDacDevice, addrRFInterface=args.trapRFDevice)
+        dev = TrapDac(addrDCInterface=args.trapDacDevice, addrRFInterface=args.trapRFDevice, configFile=args.config)
+    if args.stats:
+        instrument(dev)
         
-    simple_server_loop({"trapDac": dev}, args.bind, args.port)
+    parallel_server_loop({"trapDac": dev}, args.bind, args.port)
 
 
 if __name__ == "__main__":
@@ -4,20 +4,27 @@ import argparse
 import sys
 
 from artiqDrivers.devices.tti_ql355.driver import QL355
-from artiq.protocols.pc_rpc import simple_server_loop
-from artiq.tools import verbosity_args, simple_network_args, init_logger, bind_address_from_args
+from artiqDrivers.frontend.server import parallel_server_loop
+from artiqDrivers.instrumentation import instrument
 
 def get_argparser():
+    from artiq.tools import verbosity_args, simple_network_args
+
     parser = argparse.ArgumentParser(description="ARTIQ controller for TTI QL355P (TP) single (triple) channel power supplies")
     simple_network_args(parser, 4006)
     parser.add_argument("-d", "--device", default=None,
                         help="serial device. See documentation for how to "
                              "specify a USB Serial Number.")
+    parser.add_argument("--stats", action="store_true",
+                        help="record per-method and per-command latency "
+                             "statistics, readable with get_stats()")
     verbosity_args(parser)
     return parser
 
 
 def main():
+    from artiq.tools import init_logger, bind_address_from_args
+
     args = get_argparser().parse_args()
     init_logger(args)
 
@@ -27,12 +34,14 @@ def main():
         sys.exit(1)
 
     dev = QL355(args.device)
+    if args.stats:
+        instrument(dev)
 
     # Q: Why not use try/finally for port closure?
     # A: We don't want to try to close the serial if sys.exit() is called,
     #    and sys.exit() isn't caught by Exception
     try:
-        simple_server_loop({"ql355": dev}, bind_address_from_args(args), args.port)
+        parallel_server_loop({"ql355": dev}, bind_address_from_args(args), args.port)
     except Exception:
         dev.close()
     else:
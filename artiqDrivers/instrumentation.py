@@ -0,0 +1,102 @@
+import functools
+import inspect
+import threading
+import time
+
+from artiqDrivers.serialTransport import SerialTransport
+
+
+class LatencyStats:
+    """Call counts and latency histograms, keyed by method or command name"""
+    # Upper edges of the histogram bins in seconds. The last bin catches everything slower
+    binEdges = [1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0]
+
+    def __init__(self):
+        # Transports record from their worker threads, concurrently with the event loop
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.entries = {}
+
+    def record(self, key, duration):
+        i = 0
+        while i < len(self.binEdges) and duration > self.binEdges[i]:
+            i += 1
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = {
+                    'count': 0, 'total': 0.0, 'min': duration, 'max': duration,
+                    'histogram': [0]*(len(self.binEdges)+1)}
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['min'] = min(entry['min'], duration)
+            entry['max'] = max(entry['max'], duration)
+            entry['histogram'][i] += 1
+
+    def get(self):
+        """Returns a dictionary of {key: {'count', 'mean', 'min', 'max', 'histogram'}} with
+        times in seconds. 'histogram' counts calls taking up to 10us, 100us, 1ms, 10ms, 100ms,
+        1s, and longer"""
+        with self._lock:
+            return {key: {'count': e['count'], 'mean': e['total'] / e['count'], 'min': e['min'],
+                          'max': e['max'], 'histogram': list(e['histogram'])}
+                    for key, e in self.entries.items()}
+
+
+def _timed(stats, key, method):
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                stats.record(key, time.perf_counter() - t0)
+    else:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats.record(key, time.perf_counter() - t0)
+    return wrapper
+
+
+def _find_transports(driver):
+    """Yields the SerialTransports used by a driver, either directly or by one of its
+    interface objects"""
+    for value in vars(driver).values():
+        if isinstance(value, SerialTransport):
+            yield value
+        elif hasattr(value, '__dict__'):
+            for inner in vars(value).values():
+                if isinstance(inner, SerialTransport):
+                    yield inner
+
+
+def instrument(driver):
+    """Record the latency of every public method of a driver instance, and of every command
+    sent through its serial transports ('write <cmd>' and 'query <cmd>' entries).
+
+    Adds get_stats() and reset_stats() methods to the instance, so the statistics can be
+    read over RPC. Returns the LatencyStats."""
+    stats = LatencyStats()
+    for name in dir(type(driver)):
+        if name.startswith('_'):
+            continue
+        method = getattr(driver, name)
+        if callable(method):
+            setattr(driver, name, _timed(stats, name, method))
+    for transport in _find_transports(driver):
+        transport.stats = stats
+
+    def get_stats():
+        """Returns call counts and latency statistics per method and per command"""
+        return stats.get()
+    driver.get_stats = get_stats
+    driver.reset_stats = stats.reset
+    return stats
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RampScheduler:
+    """Runs slow-scan ramps for several channels concurrently in the background.
+
+    Each channel is moved towards its target in steps of at most 'step', waiting 'interval'
+    seconds between steps. Setting a new target for a channel that is already ramping redirects
+    the running ramp rather than queuing another one."""
+    def __init__(self, write, interval):
+        """write : coroutine function write(channel, value) that sets a channel
+        interval : time in seconds between steps"""
+        self.write = write
+        self.interval = interval
+        self._current = {}
+        self._targets = {}
+        self._steps = {}
+        self._tasks = {}
+
+    def ramp(self, channel, current, target, step):
+        """Start ramping a channel from current to target and return immediately.
+
+        If the channel is already ramping, the ramp carries on from where it is to the new
+        target (with the new step size) and current is ignored."""
+        if step <= 0:
+            raise ValueError("Ramp step must be positive")
+        self._targets[channel] = target
+        self._steps[channel] = step
+        if not self.is_ramping(channel):
+            self._current[channel] = current
+            self._tasks[channel] = asyncio.ensure_future(self._run(channel))
+
+    async def _run(self, channel):
+        try:
+            while True:
+                current = self._current[channel]
+                target = self._targets[channel]
+                step = self._steps[channel]
+                if abs(target - current) > step:
+                    current += step if target > current else -step
+                else:
+                    current = target
+                await self.write(channel, current)
+                self._current[channel] = current
+                # The target may have moved while we were writing
+                if current == self._targets[channel]:
+                    return
+                await asyncio.sleep(self.interval)
+        except Exception:
+            logger.exception("Ramp of channel '{}' failed".format(channel))
+            raise
+
+    def is_ramping(self, channel):
+        task = self._tasks.get(channel)
+        return task is not None and not task.done()
+
+    async def wait(self, channel):
+        """Wait until a channel has reached its target. Raises the exception that stopped the
+        ramp, if any. Returns immediately if the channel was never ramped"""
+        task = self._tasks.get(channel)
+        if task is not None:
+            # Shield, so that a client giving up waiting doesn't stop the ramp
+            await asyncio.shield(task)
+
+    def progress(self, channel):
+        """Returns a dictionary with the last written value, the target, and whether the channel
+        is still ramping"""
+        return {'current': self._current.get(channel),
+                'target': self._targets.get(channel),
+                'ramping': self.is_ramping(channel)}
@@ -0,0 +1,163 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SerialTransport:
+    """Wraps an open pyserial port with line framing, timeouts and request/response matching.
+
+    Every transaction (a write, a read, a query, or any driver function run through call /
+    call_async) holds the transport lock for its whole duration, so a response is always read
+    by the request that caused it, whichever thread or coroutine issued it.
+
+    The blocking methods all have a coroutine counterpart (suffixed _async) that runs the
+    transaction on a worker thread dedicated to this port. Controllers use these so that a slow
+    transaction does not stall the event loop serving other RPC clients."""
+    def __init__(self, port, terminator=b'\n', timeout=None):
+        """port : an open pyserial port
+        terminator : line terminator used by read_line
+        timeout : read timeout in seconds, None to block until the terminator arrives"""
+        self.port = port
+        self.port.timeout = timeout
+        self.terminator = terminator
+        self.lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # Set to an artiqDrivers.instrumentation.LatencyStats to time every command
+        self.stats = None
+        # Received bytes not yet returned by a read
+        self._buffer = bytearray()
+
+    def close(self):
+        self._executor.shutdown()
+        self.port.close()
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn as a single transaction"""
+        with self.lock:
+            return fn(*args, **kwargs)
+
+    async def call_async(self, fn, *args, **kwargs):
+        """Run fn as a single transaction on the worker thread"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self.call, fn, *args, **kwargs))
+
+    def write(self, data):
+        """Write a str or bytes to the port"""
+        if isinstance(data, str):
+            data = data.encode()
+        with self.lock:
+            if self.stats is None:
+                self.port.write(data)
+            else:
+                t0 = time.perf_counter()
+                self.port.write(data)
+                self.stats.record("write " + _command_name(data), time.perf_counter() - t0)
+
+    def _fill(self):
+        """Move everything the port has received into the buffer, waiting up to the timeout
+        for at least one byte. Returns False on timeout"""
+        data = self.port.read(max(1, self.port.in_waiting))
+        self._buffer += data
+        return len(data) > 0
+
+    def read(self, size=1):
+        """Read size bytes and return them decoded. On timeout returns whatever was read
+        so far, which may be ''"""
+        with self.lock:
+            while len(self._buffer) < size:
+                if not self._fill():
+                    break
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data.decode()
+
+    def read_line(self, timeout=None):
+        """Read a terminated line and return it decoded, including the terminator.
+        On timeout returns whatever was read so far, which may be ''.
+        timeout overrides the port's read timeout for this line only"""
+        with self.lock:
+            if timeout is None:
+                return self._read_line()
+            portTimeout = self.port.timeout
+            self.port.timeout = timeout
+            try:
+                return self._read_line()
+            finally:
+                self.port.timeout = portTimeout
+
+    def _read_line(self):
+        with self.lock:
+            t0 = time.perf_counter()
+            start = 0
+            while True:
+                end = self._buffer.find(self.terminator, start)
+                if end >= 0:
+                    end += len(self.terminator)
+                    break
+                # Only search the new data next time, allowing for a split terminator
+                start = max(0, len(self._buffer) - len(self.terminator) + 1)
+                if not self._fill():
+                    end = len(self._buffer)
+                    break
+            line = bytes(self._buffer[:end])
+            del self._buffer[:end]
+            if self.stats is not None:
+                self.stats.record("read line", time.perf_counter() - t0)
+        return line.decode()
+
+    def drain(self):
+        """Discard all input received until a read timeout"""
+        with self.lock:
+            self._buffer.clear()
+            while self._fill():
+                self._buffer.clear()
+
+    def reset_input(self):
+        """Discard all input received so far"""
+        with self.lock:
+            self._buffer.clear()
+            self.port.reset_input_buffer()
+
+    def query(self, data, lines=1):
+        """Write data and read back a given number of lines. Returns a single line if
+        lines is 1, otherwise a list of lines"""
+        with self.lock:
+            t0 = time.perf_counter()
+            self.write(data)
+            response = [self.read_line() for _ in range(lines)]
+            if self.stats is not None:
+                self.stats.record("query " + _command_name(data), time.perf_counter() - t0)
+        return response[0] if lines == 1 else response
+
+    async def write_async(self, data):
+        return await self.call_async(self.write, data)
+
+    async def read_line_async(self, timeout=None):
+        return await self.call_async(self.read_line, timeout)
+
+    async def query_async(self, data, lines=1):
+        return await self.call_async(self.query, data, lines)
+
+
+def _command_name(data):
+    """The first word of a command, used to group statistics"""
+    if isinstance(data, bytes):
+        data = data.decode(errors='replace')
+    words = data.split(None, 1)
+    return words[0] if words else repr(data)
+
+
+def transaction(method):
+    """Decorator turning a blocking driver method into a coroutine, run as a single transaction
+    on the worker thread of the driver's SerialTransport (self.transport).
+
+    If the driver has no transport (e.g. in simulation) the method is run directly."""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self.transport is None:
+            return method(self, *args, **kwargs)
+        return await self.transport.call_async(method, self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def _codec():
+    """Returns (encode, decode) functions: pyon's if ARTIQ is installed, else JSON's. Setpoints
+    are plain numbers, for which the two formats are the same"""
+    try:
+        import artiq.protocols.pyon as pyon
+    except ImportError:
+        return json.dumps, json.loads
+    return pyon.encode, pyon.decode
+
+
+class SetpointJournal:
+    """Persists a dictionary of setpoints so that it survives a crash.
+
+    The setpoints are kept in a pyon (or, without ARTIQ, JSON) snapshot file. Changes are
+    collected in memory and, shortly after the first of them, appended to a journal file next
+    to it in one write, so high-rate updates cost one disk write per flush_delay at most. Some
+    time after a change the journal is compacted: the snapshot is rewritten atomically
+    (written to a temporary file and renamed over the old one) and the journal emptied. At
+    startup the journal is replayed over the snapshot, so a crash loses at most the last
+    flush_delay of changes."""
+    def __init__(self, fname, flush_delay=0.1, compact_delay=10.0):
+        """fname : snapshot file name. The journal is fname + '.journal'
+        flush_delay : time in seconds from a change to appending it to the journal
+        compact_delay : time in seconds from a change to compacting the journal"""
+        self.fname = fname
+        self.journal_fname = fname + ".journal"
+        self.flush_delay = flush_delay
+        self.compact_delay = compact_delay
+        self.values = {}
+        self._pending = {}
+        self._journal = None
+        self._flush_handle = None
+        self._compact_handle = None
+
+    def load(self):
+        """Read the snapshot and replay the journal. Returns the setpoints, or None if
+        neither file exists"""
+        encode, decode = _codec()
+        found = False
+        try:
+            with open(self.fname) as f:
+                self.values = decode(f.read())
+            found = True
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self.journal_fname) as f:
+                lines = f.readlines()
+            found = True
+        except FileNotFoundError:
+            lines = []
+        for i, line in enumerate(lines):
+            try:
+                self.values.update(decode(line))
+            except Exception:
+                # A crash while appending can leave the last line incomplete
+                if i == len(lines) - 1:
+                    logger.warning("Ignoring incomplete last entry of '{}'".format(self.journal_fname))
+                else:
+                    raise
+        if lines:
+            self.compact()
+        return self.values if found else None
+
+    def record(self, changes):
+        """Record a dictionary of changed setpoints, and schedule appending them to the
+        journal and compaction. Doesn't touch the disk itself"""
+        self.values.update(changes)
+        self._pending.update(changes)
+        loop = asyncio.get_event_loop()
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_delay, self.flush)
+        if self._compact_handle is None:
+            self._compact_handle = loop.call_later(self.compact_delay, self.compact)
+
+    def flush(self):
+        """Append the changes recorded since the last flush to the journal, as one entry"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        encode, decode = _codec()
+        if self._journal is None:
+            self._journal = open(self.journal_fname, "a")
+        self._journal.write(encode(self._pending) + "\n")
+        # A change is only safe once it is on disk, not just in the OS's buffers
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._pending = {}
+
+    def compact(self):
+        """Rewrite the snapshot with the current setpoints and empty the journal"""
+        encode, decode = _codec()
+        if self._compact_handle is not None:
+            self._compact_handle.cancel()
+            self._compact_handle = None
+        # The snapshot holds every value, pending changes included
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._pending = {}
+        tmp_fname = self.fname + ".tmp"
+        with open(tmp_fname, "w") as f:
+            f.write(encode(self.values))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fname, self.fname)
+        # Only now is it safe to drop the journal. Should we crash before this, replaying
+        # the journal over the new snapshot sets the same values again
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        open(self.journal_fname, "w").close()
+
+    def close(self):
+        """Compact the journal and close its file. The journal can be used again afterwards"""
+        self.compact()
@@ -7,7 +7,8 @@ scripts = [
     "trapDac_controller=artiqDrivers.frontend.trapDac_controller:main",
     "thorlabs_mdt69xb_controller=artiqDrivers.frontend.thorlabs_mdt69xb_controller:main",
     "rohdeSynth_controller=artiqDrivers.frontend.rohdeSynth_controller:main",
-    "tti_ql355_controller=artiqDrivers.frontend.tti_ql355_controller:main"
+    "tti_ql355_controller=artiqDrivers.frontend.tti_ql355_controller:main",
+    "multi_controller=artiqDrivers.frontend.multi_controller:main"
 ]
 
 setup(name='artiqDrivers',
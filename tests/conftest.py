@@ -0,0 +1,13 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def loop():
+    """A fresh event loop, set as the current one, as the drivers expect"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from artiqDrivers import fakeDevices
+from artiqDrivers.devices.arduinoDds.driver import ArduinoDds
+
+
+@pytest.fixture
+def dds(loop):
+    fake = fakeDevices.FakeArduinoDds(acknowledged=True)
+    dev = ArduinoDds(fake.addr, 1e9, acknowledged=True)
+    yield dev, fake
+    dev.transport.close()
+    fake.close()
+
+
+def plsbCommands(fake):
+    return [c for c in fake.commands if c.startswith('PLSB')]
+
+
+def test_repeated_profile_is_skipped(dds, loop):
+    dev, fake = dds
+    loop.run_until_complete(dev.setProfile(3, 100e6))
+    loop.run_until_complete(dev.setProfile(3, 100e6))
+    assert len(plsbCommands(fake)) == 1
+    assert dev.getProfileCacheStats() == {'hits': 1, 'misses': 1}
+    assert fake.profiles[3] == dev.profileCache[3]
+
+
+def test_failed_write_is_not_cached(dds, loop):
+    dev, fake = dds
+    def failingWrite(cmd):
+        raise IOError("write failed")
+    dev._writeProfile = failingWrite
+
+    async def concurrent():
+        return await asyncio.gather(dev.setProfileLSB(0, 1, 2, 3), dev.setProfileLSB(0, 1, 2, 3),
+                                    return_exceptions=True)
+    results = loop.run_until_complete(concurrent())
+    # Neither call may report success for a write that failed
+    assert all(isinstance(r, IOError) for r in results)
+    assert dev.profileCache == {}
+
+
+def test_reset_invalidates_cache(dds, loop):
+    dev, fake = dds
+    loop.run_until_complete(dev.setProfile(1, 80e6))
+    loop.run_until_complete(dev.reset())
+    loop.run_until_complete(dev.setProfile(1, 80e6))
+    assert len(plsbCommands(fake)) == 2
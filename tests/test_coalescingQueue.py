@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from artiqDrivers.coalescingQueue import CoalescingQueue
+
+
+class Recorder:
+    def __init__(self, fail=False):
+        self.writes = []
+        self.fail = fail
+
+    async def write(self, channel, value):
+        await asyncio.sleep(0.001)
+        if self.fail:
+            raise IOError("write failed")
+        self.writes.append((channel, value))
+
+    async def write_many(self, values):
+        await asyncio.sleep(0.001)
+        if self.fail:
+            raise IOError("write failed")
+        self.writes.append(dict(values))
+
+
+def test_only_latest_value_is_written(loop):
+    recorder = Recorder()
+    queue = CoalescingQueue(recorder.write)
+
+    async def run():
+        futures = [queue.put('x', v) for v in range(10)]
+        await queue.flush()
+        return [f.result() for f in futures]
+    results = loop.run_until_complete(run())
+    assert recorder.writes == [('x', 9)]
+    # Every caller learns the value that was written in its place
+    assert results == [9]*10
+
+
+def test_channels_keep_first_queued_order(loop):
+    recorder = Recorder()
+    queue = CoalescingQueue(recorder.write)
+
+    async def run():
+        queue.put('a', 0)
+        await asyncio.sleep(0)
+        for channel, value in [('x', 1), ('y', 2), ('x', 3), ('z', 4), ('y', 5)]:
+            queue.put(channel, value)
+        await queue.flush()
+    loop.run_until_complete(run())
+    assert recorder.writes == [('a', 0), ('x', 3), ('y', 5), ('z', 4)]
+
+
+def test_write_many_batches_pending_channels(loop):
+    recorder = Recorder()
+    queue = CoalescingQueue(recorder.write, recorder.write_many)
+
+    async def run():
+        queue.put('x', 1)
+        await asyncio.sleep(0)
+        queue.put('y', 2)
+        queue.put('z', 3)
+        queue.put('y', 4)
+        await queue.flush()
+    loop.run_until_complete(run())
+    assert recorder.writes == [{'x': 1}, {'y': 4, 'z': 3}]
+
+
+def test_failure_reaches_waiters(loop):
+    recorder = Recorder(fail=True)
+    queue = CoalescingQueue(recorder.write)
+
+    async def run():
+        future = queue.put('x', 1)
+        with pytest.raises(IOError):
+            await queue.flush('x')
+        assert isinstance(future.exception(), IOError)
+        assert not queue.is_pending('x')
+    loop.run_until_complete(run())
@@ -0,0 +1,83 @@
+import pytest
+
+from artiqDrivers import fakeDevices
+from artiqDrivers.devices.coherentDds.driver import CoherentDds
+
+
+@pytest.fixture
+def dds(loop):
+    fake = fakeDevices.FakeCoherentDds()
+    dev = CoherentDds(fake.addr, 1e9)
+    yield dev, fake
+    dev.transport.close()
+    fake.close()
+
+
+def setProfileCommands(dev, fake, loop):
+    # identity() is a round trip, so the fake has seen every earlier write once it returns
+    loop.run_until_complete(dev.identity())
+    return [c for c in fake.commands if c.startswith('setProfile ')]
+
+
+def test_repeated_profile_is_skipped(dds, loop):
+    dev, fake = dds
+    loop.run_until_complete(dev.setProfile(0, 1, 100e6, 90.0, 0.5))
+    loop.run_until_complete(dev.setProfile(0, 1, 100e6, 90.0, 0.5))
+    assert len(setProfileCommands(dev, fake, loop)) == 1
+    assert dev.getProfileCacheStats() == {'hits': 1, 'misses': 1}
+    assert fake.profiles[(0, 1)] == dev.profileCache[(0, 1)]
+
+
+def test_failed_write_is_not_cached(dds, loop):
+    dev, fake = dds
+    send = dev.send
+    def failingSend(data):
+        raise IOError("write failed")
+    dev.send = failingSend
+    with pytest.raises(IOError):
+        loop.run_until_complete(dev.setProfile(0, 0, 100e6))
+    with pytest.raises(IOError):
+        loop.run_until_complete(dev.setProfiles([(0, 1, 100e6, 0.0, 1.0)]))
+    assert dev.profileCache == {}
+
+    dev.send = send
+    loop.run_until_complete(dev.setProfile(0, 0, 100e6))
+    assert len(setProfileCommands(dev, fake, loop)) == 1
+
+
+def test_reset_invalidates_cache(dds, loop):
+    dev, fake = dds
+    loop.run_until_complete(dev.setProfile(2, 3, 50e6))
+    loop.run_until_complete(dev.reset())
+    loop.run_until_complete(dev.setProfile(2, 3, 50e6))
+    assert len(setProfileCommands(dev, fake, loop)) == 2
+    assert (2, 3) in fake.profiles
+
+
+def test_setProfiles_sends_only_changed_rows(dds, loop):
+    dev, fake = dds
+    table = [(ch, p, 100e6 + p, 0.0, 1.0) for ch in range(4) for p in range(8)]
+    loop.run_until_complete(dev.setProfiles(table))
+    table[5] = (0, 5, 200e6, 0.0, 1.0)
+    loop.run_until_complete(dev.setProfiles(table))
+    assert len(setProfileCommands(dev, fake, loop)) == 33
+    assert fake.profiles == dev.profileCache
+
+
+@pytest.mark.parametrize("profiles", [
+    [(1.5, 2.7, 100e6, 0.0, 1.0)],
+    [(0, 0, float('nan'), 0.0, 1.0)],
+    [(0, 0, 100e6, 0.0)]*5,
+])
+def test_setProfiles_rejects_bad_tables(dds, loop, profiles):
+    dev, fake = dds
+    with pytest.raises(ValueError):
+        loop.run_until_complete(dev.setProfiles(profiles))
+    assert setProfileCommands(dev, fake, loop) == []
+
+
+def test_setProfilesWords_rejects_bad_row_length(dds, loop):
+    dev, fake = dds
+    with pytest.raises(ValueError):
+        loop.run_until_complete(dev.setProfilesWords([[0, 0, 1, 2]]*5))
+    assert setProfileCommands(dev, fake, loop) == []
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from artiqDrivers.setpointJournal import SetpointJournal
+
+
+@pytest.fixture
+def fname(tmp_path):
+    return str(tmp_path / "setpoints.pyon")
+
+
+def test_missing_files_load_as_none(fname, loop):
+    assert SetpointJournal(fname).load() is None
+
+
+def test_round_trip_through_snapshot(fname, loop):
+    journal = SetpointJournal(fname)
+    journal.record({'x': 10.0, 'y': 20.0})
+    journal.record({'x': 11.0})
+    journal.close()
+    assert SetpointJournal(fname).load() == {'x': 11.0, 'y': 20.0}
+
+
+def test_journal_is_replayed_after_crash(fname, loop):
+    journal = SetpointJournal(fname, flush_delay=0.01)
+    journal.record({'x': 10.0})
+    journal.compact()
+    journal.record({'x': 12.0, 'z': 5.0})
+    journal.record({'z': 6.0})
+    # Let the debounced flush run, then "crash" before compaction
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert SetpointJournal(fname).load() == {'x': 12.0, 'z': 6.0}
+
+
+def test_updates_are_coalesced_into_one_entry(fname, loop):
+    journal = SetpointJournal(fname, flush_delay=0.01)
+    for i in range(100):
+        journal.record({'x': float(i)})
+    loop.run_until_complete(asyncio.sleep(0.05))
+    with open(journal.journal_fname) as f:
+        assert len(f.readlines()) == 1
+    journal.close()
+
+
+def test_incomplete_last_entry_is_ignored(fname, loop):
+    journal = SetpointJournal(fname)
+    journal.record({'x': 10.0})
+    journal.close()
+    with open(journal.journal_fname, "w") as f:
+        f.write('{"y": 1.0}\n{"x": 3')
+    assert SetpointJournal(fname).load() == {'x': 10.0, 'y': 1.0}
+
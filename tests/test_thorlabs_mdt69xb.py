@@ -0,0 +1,51 @@
+import os
+import time
+
+import pytest
+
+from artiqDrivers import fakeDevices
+from artiqDrivers.devices.thorlabs_mdt69xb import driver
+from artiqDrivers.devices.thorlabs_mdt69xb.driver import PiezoController
+
+
+class StallingMDT69xB(fakeDevices.FakeMDT69xB):
+    """Pauses in the middle of the identity paragraph, for longer than the driver waits"""
+    stall = False
+
+    def handle(self, command):
+        reply = super().handle(command)
+        if command.lower() == 'id?' and self.stall:
+            first, rest = reply.split('Serial#', 1)
+            os.write(self._master, first.encode())
+            time.sleep(5*PiezoController.idle_gap)
+            return 'Serial#' + rest
+        return reply
+
+
+@pytest.fixture
+def piezo(loop, tmp_path, monkeypatch):
+    # The driver keeps its setpoint files in the working directory
+    monkeypatch.chdir(tmp_path)
+    driver._identities.clear()
+    fake = StallingMDT69xB()
+    dev = PiezoController(fake.addr)
+    yield dev, fake
+    dev.close()
+    fake.close()
+    driver._identities.clear()
+
+
+def test_cut_short_identity_is_not_cached_or_left_behind(piezo, loop, caplog):
+    dev, fake = piezo
+    driver._identities.clear()
+    fake.stall = True
+    identity = dev._get_id(refresh=True)
+    assert dev.id_end_marker not in identity
+    assert driver._identities == {}
+    # The rest of the paragraph must not be read as the reply to the next command
+    caplog.clear()
+    loop.run_until_complete(dev.set_channel('x', 10.0))
+    assert loop.run_until_complete(dev.get_voltage_limit()) == 150
+    assert not [r for r in caplog.records if "unexpected character" in r.getMessage()]
+    fake.stall = False
+    assert loop.run_until_complete(dev.get_serial()) == '000000-00'